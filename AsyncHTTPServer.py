@@ -0,0 +1,467 @@
+"""
+AsyncHTTPServer
+
+A small HTTP/1.1 server on an asyncio event loop with keep-alive, gzip
+and static file caching.
+
+Copyright (c) 2014 All Right Reserved, Liam Wickins
+
+Please see the LICENSE file for more information.
+
+THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+PARTICULAR PURPOSE.
+"""
+
+from __future__ import print_function
+import BaseHTTPServer
+import email.utils
+import mimetypes
+import os
+import sys
+import threading
+import time
+import urlparse
+import zlib
+from LruCache import LruCache
+
+# Python 2 has no asyncio, the trollius backport provides the same API
+try:
+  import asyncio
+except ImportError:
+  import trollius as asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+def Debug(*objs):
+  print("AsyncHTTPServer:", *objs, file=sys.stderr)
+
+class HTTPRequest():
+  """A parsed request, header names are held in lower case"""
+
+  def __init__(self, method, target, version, headers, body):
+    self.method = method
+    self.version = version
+    self.headers = headers
+    self.body = body
+    url = urlparse.urlparse(target)
+    self.path = urlparse.unquote(url.path)
+    self.query = urlparse.parse_qs(url.query)
+
+  def GetHeader(self, name, default=None):
+    return self.headers.get(name.lower(), default)
+
+  def GetQuery(self, name, default=None):
+    return self.query.get(name, [default])[0]
+
+  def KeepAlive(self):
+    """Tells us whether the client wants the connection kept open"""
+    connection = self.GetHeader('Connection', '').lower()
+    if (self.version == 'HTTP/1.1'):
+      return connection != 'close'
+    return connection == 'keep-alive'
+
+  def AcceptsGzip(self):
+    return 'gzip' in self.GetHeader('Accept-Encoding', '')
+
+class HTTPResponse():
+  """A response to a request.  Setting stream to (EventStream, lastId) makes
+     it a server-sent event stream, which stays open after the headers"""
+
+  def __init__(self, status=200, body='', contentType=None, headers=None):
+    self.status = status
+    self.body = body
+    self.headers = list(headers or [])
+    if (contentType):
+      self.headers.append(('Content-Type', contentType))
+    self.stream = None
+
+  def GetHeader(self, name, default=None):
+    for (k, v) in self.headers:
+      if (k.lower() == name.lower()):
+        return v
+    return default
+
+class DeferredResponse():
+  """A response a handler finishes later, e.g., once a queued command has
+     run, so that no worker thread waits for it.  Set() may be called from
+     any thread"""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.response = None
+    self.callback = None
+
+  def Set(self, response):
+    with self.lock:
+      self.response = response
+      callback = self.callback
+    if (callback):
+      callback(response)
+
+  def AddCallback(self, callback):
+    """Call callback(response) once the response is set"""
+    with self.lock:
+      if (self.response is None):
+        self.callback = callback
+        return
+    callback(self.response)
+
+class HTTPProtocol(asyncio.Protocol):
+  """One connection to the server.  Requests on a connection are served one
+     at a time in the order they arrive, and the connection is kept open
+     between them until it has been idle for KEEPALIVE_TIMEOUT.  Static
+     files already in memory are served on the loop, anything else by a
+     worker thread"""
+
+  def __init__(self, server):
+    self.server = server
+    self.loop = server.loop
+    self.transport = None
+    self.buffer = ''
+    self.busy = False
+    self.timer = None
+    self.stream = None
+    self.lastId = None
+
+  def connection_made(self, transport):
+    self.transport = transport
+    self.server.connections += 1
+    self.__Idle()
+
+  def connection_lost(self, exc):
+    self.transport = None
+    self.__CancelTimer()
+    if (self.stream):
+      self.stream.RemoveWatcher(self.__Wake)
+      self.stream.RemoveListener()
+      self.stream = None
+
+  def data_received(self, data):
+    if (self.stream):
+      return
+    self.buffer += data
+    if (len(self.buffer) > self.server.MAX_REQUEST_SIZE):
+      self.transport.close()
+      return
+    self.__Next()
+
+  def __CancelTimer(self):
+    if (self.timer):
+      self.timer.cancel()
+      self.timer = None
+
+  def __Idle(self):
+    """Helper function to close the connection if no request arrives"""
+    self.__CancelTimer()
+    self.timer = self.loop.call_later(self.server.KEEPALIVE_TIMEOUT,
+                                      self.transport.close)
+
+  def __Parse(self):
+    """Helper function to take the next complete request from the buffer.
+       Returns None if there isn't one yet"""
+    end = self.buffer.find('\r\n\r\n')
+    if (end < 0):
+      return None
+    lines = self.buffer[:end].split('\r\n')
+    (method, target, version) = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+      (name, sep, value) = line.partition(':')
+      headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if (len(self.buffer) < end + 4 + length):
+      return None
+    body = self.buffer[end+4:end+4+length]
+    self.buffer = self.buffer[end+4+length:]
+    return HTTPRequest(method, target, version, headers, body)
+
+  def __Next(self):
+    """Helper function to start serving the next request, if any"""
+    if (self.busy or not self.transport):
+      return
+    try:
+      request = self.__Parse()
+    except ValueError:
+      self.transport.write(self.server.Encode(None,
+                             HTTPResponse(400, 'Bad request', 'text/plain')))
+      self.transport.close()
+      return
+    if (request is None):
+      return
+    self.busy = True
+    self.__CancelTimer()
+    self.server.requests += 1
+    response = self.server.StaticFile(request)
+    if (response):
+      self.__Send(request, response)
+      return
+    future = self.loop.run_in_executor(self.server.executor,
+                                       self.server.Handle, request)
+    future.add_done_callback(lambda f: self.__Respond(request, f))
+
+  def __Respond(self, request, future):
+    """Helper function to send a response once its worker has finished"""
+    response = future.result()
+    if (isinstance(response, DeferredResponse)):
+      response.AddCallback(lambda r: self.loop.call_soon_threadsafe(
+                                       self.__Finish, request, r))
+    else:
+      self.__Send(request, response)
+
+  def __Finish(self, request, response):
+    """Helper function to send a deferred response once it's set"""
+    self.__Send(request, self.server.Compress(request, response))
+
+  def __Send(self, request, response):
+    if (not self.transport):
+      return
+    self.transport.write(self.server.Encode(request, response))
+    if (response.stream):
+      self.__StartStream(*response.stream)
+    elif (request.KeepAlive()):
+      self.busy = False
+      self.__Idle()
+      self.__Next()
+    else:
+      self.transport.close()
+
+  def __StartStream(self, stream, lastId):
+    """Helper function to send events from a stream as they're published"""
+    self.stream = stream
+    self.stream.AddListener()
+    # Watch before listening so that nothing published in between is missed,
+    # __Pending only sends what's after the last event sent
+    self.stream.AddWatcher(self.__Wake)
+    self.__SendEvents(stream.Listen(lastId))
+
+  def __Wake(self):
+    """Called with the stream locked when an event is published"""
+    self.loop.call_soon_threadsafe(self.__Pending)
+
+  def __Pending(self):
+    if (self.stream and self.transport):
+      events = self.stream.Listen(self.lastId or 0)
+      self.__SendEvents([e for e in events if e[0] > self.lastId])
+
+  def __SendEvents(self, events):
+    """Helper function to send events, or a comment to keep an idle stream
+       open"""
+    self.__CancelTimer()
+    if (events):
+      self.transport.write(''.join(self.stream.Format(e) for e in events))
+      self.lastId = events[-1][0]
+    self.timer = self.loop.call_later(self.server.EVENT_KEEPALIVE,
+                                      self.__KeepStreamAlive)
+
+  def __KeepStreamAlive(self):
+    if (self.stream and self.transport):
+      self.transport.write(": keepalive\n\n")
+      self.__SendEvents([])
+
+class AsyncHTTPServer():
+  """Serves HTTP from a single event loop thread, so that connections cost
+     no more than their sockets.  Handlers for each route run on a pool of
+     worker threads and may block, or return a DeferredResponse to finish
+     without holding a worker.  Anything not routed is served from files in
+     documentRoot.
+
+     Connections are kept open between requests (HTTP/1.1 keep-alive) and
+     large responses are gzipped for clients which accept it.  Static files
+     are held in memory, gzipped once, and sent with validators so that
+     browsers only fetch them again when they change.  Files are checked
+     for changes on a worker thread, at most every STATIC_CHECK_INTERVAL,
+     so the loop never waits on the disk.
+  """
+
+  # Responses smaller than this many bytes aren't worth compressing
+  GZIP_MIN_SIZE = 1024
+
+  # Content types which are compressed
+  GZIP_TYPES = [ 'text/', 'application/json', 'application/javascript' ]
+
+  # Seconds an idle connection is kept open
+  KEEPALIVE_TIMEOUT = 15
+
+  # Seconds between keep-alive comments on an idle event stream
+  EVENT_KEEPALIVE = 15
+
+  # Largest request accepted, including its headers
+  MAX_REQUEST_SIZE = 1 << 20
+
+  # Seconds browsers may use static files without checking they've changed.
+  # HTML is always checked so that changes to the UI are seen straight away
+  STATIC_MAX_AGE = 3600
+
+  # Seconds a static file held in memory is served without checking whether
+  # it has changed on disk
+  STATIC_CHECK_INTERVAL = 1
+
+  def __init__(self, addr, documentRoot='.', loop=None, staticCacheSize=64,
+               workers=16):
+    self.addr = addr
+    self.documentRoot = os.path.abspath(documentRoot)
+    self.loop = loop or asyncio.get_event_loop()
+    self.executor = ThreadPoolExecutor(workers)
+    self.routes = []
+    self.static = LruCache(staticCacheSize)
+    self.connections = 0
+    self.requests = 0
+
+  def Route(self, method, prefix, handler):
+    """Serve requests for paths starting with prefix with handler(request),
+       which returns an HTTPResponse or DeferredResponse.  Routes are matched
+       in the order added"""
+    self.routes.append((method, prefix, handler))
+
+  def __FindRoute(self, request):
+    for (method, prefix, handler) in self.routes:
+      if (request.method == method and request.path.startswith(prefix)):
+        return handler
+    return None
+
+  def Serve(self):
+    """Serve forever"""
+    (host, port) = self.addr
+    server = self.loop.run_until_complete(
+      self.loop.create_server(lambda: HTTPProtocol(self), host or None, port))
+    try:
+      self.loop.run_forever()
+    finally:
+      server.close()
+      self.executor.shutdown(wait=False)
+
+  def Handle(self, request):
+    """Serve a request, runs on a worker thread"""
+    try:
+      handler = self.__FindRoute(request)
+      if (handler):
+        response = handler(request)
+      elif (request.method in ('GET', 'HEAD')):
+        response = self.__StaticFile(request, load=True)
+      else:
+        response = HTTPResponse(405, 'Method not allowed', 'text/plain')
+    except Exception as e:
+      Debug("Request failed:", request.method, request.path, e)
+      response = HTTPResponse(500, 'Internal server error', 'text/plain')
+    if (isinstance(response, DeferredResponse)):
+      return response
+    return self.Compress(request, response)
+
+  def StaticFile(self, request):
+    """Serve a request for a static file from memory, runs on the loop so
+       that files are never held up behind slow handlers.  Returns None if
+       the request isn't for a static file, or it has to be read first"""
+    if (request.method not in ('GET', 'HEAD') or self.__FindRoute(request)):
+      return None
+    response = self.__StaticFile(request, load=False)
+    return response and self.Compress(request, response)
+
+  @staticmethod
+  def __Gzip(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+  def __IsCompressible(self, contentType):
+    return any((contentType or '').startswith(t) for t in self.GZIP_TYPES)
+
+  def Compress(self, request, response):
+    """Gzip a response's body if it is worthwhile.  Returns the response"""
+    if (response.stream is not None or
+        not self.__IsCompressible(response.GetHeader('Content-Type'))):
+      return response
+    response.headers.append(('Vary', 'Accept-Encoding'))
+    if (len(response.body) < self.GZIP_MIN_SIZE or
+        not request.AcceptsGzip() or
+        response.GetHeader('Content-Encoding')):
+      return response
+    response.body = AsyncHTTPServer.__Gzip(response.body)
+    response.headers.append(('Content-Encoding', 'gzip'))
+    return response
+
+  def __StaticFile(self, request, load):
+    """Helper function to serve a file under documentRoot.  If load is False
+       the disk isn't touched, None is returned instead if the file hasn't
+       been checked recently or has to be read or compressed"""
+    path = os.path.normpath(os.path.join(self.documentRoot,
+                                         request.path.lstrip('/')))
+    if (path != self.documentRoot and
+        not path.startswith(self.documentRoot + os.sep)):
+      return HTTPResponse(404, 'Not found', 'text/plain')
+    # Cached by the path requested, which may be a directory
+    cached = self.static.Get(path)
+    now = time.time()
+    if (not load):
+      if (cached is None or
+          now - cached['checked'] >= self.STATIC_CHECK_INTERVAL):
+        return None
+    else:
+      filePath = path
+      if (os.path.isdir(filePath)):
+        filePath = os.path.join(filePath, 'index.html')
+      try:
+        st = os.stat(filePath)
+      except OSError:
+        self.static.Remove(path)
+        return HTTPResponse(404, 'Not found', 'text/plain')
+      stamp = (st.st_mtime, st.st_size)
+      if (cached is None or cached['stamp'] != stamp):
+        with open(filePath, 'rb') as f:
+          data = f.read()
+        contentType = (mimetypes.guess_type(filePath)[0] or
+                       'application/octet-stream')
+        cached = { 'stamp': stamp, 'checked': now, 'data': data, 'gzip': None,
+                   'contentType': contentType,
+                   'etag': '"%x-%x"' % (int(st.st_mtime), st.st_size),
+                   'modified': email.utils.formatdate(st.st_mtime, usegmt=True) }
+        self.static.Put(path, cached)
+      else:
+        cached['checked'] = now
+    headers = [ ('ETag', cached['etag']),
+                ('Last-Modified', cached['modified']) ]
+    if (cached['contentType'] == 'text/html'):
+      headers.append(('Cache-Control', 'no-cache'))
+    else:
+      headers.append(('Cache-Control', 'public, max-age=%d' %
+                                       self.STATIC_MAX_AGE))
+    if (request.GetHeader('If-None-Match') == cached['etag'] or
+        request.GetHeader('If-Modified-Since') == cached['modified']):
+      return HTTPResponse(304, headers=headers)
+    response = HTTPResponse(200, cached['data'], cached['contentType'], headers)
+    # Static files are only compressed once
+    if (len(cached['data']) >= self.GZIP_MIN_SIZE and request.AcceptsGzip() and
+        self.__IsCompressible(cached['contentType'])):
+      if (cached['gzip'] is None):
+        if (not load):
+          return None
+        cached['gzip'] = AsyncHTTPServer.__Gzip(cached['data'])
+      response.body = cached['gzip']
+      response.headers.append(('Content-Encoding', 'gzip'))
+    return response
+
+  def Encode(self, request, response):
+    """Encode a response's status line, headers and body"""
+    reason = BaseHTTPServer.BaseHTTPRequestHandler.responses.get(
+               response.status, ('',))[0]
+    lines = [ 'HTTP/1.1 %d %s' % (response.status, reason),
+              'Date: ' + email.utils.formatdate(usegmt=True) ]
+    lines += [ '%s: %s' % (k, v) for (k, v) in response.headers ]
+    if (response.stream):
+      lines.append('Cache-Control: no-cache')
+    else:
+      lines.append('Content-Length: %d' % len(response.body))
+      if (request and request.KeepAlive()):
+        lines.append('Connection: keep-alive')
+      else:
+        lines.append('Connection: close')
+    head = '\r\n'.join(lines) + '\r\n\r\n'
+    if (response.stream or (request and request.method == 'HEAD')):
+      return head
+    return head + response.body
+
+  def GetStats(self):
+    """Number of connections and requests served, and static cache
+       statistics"""
+    return { 'connections': self.connections,
+             'requests': self.requests,
+             'static': self.static.GetStats() }
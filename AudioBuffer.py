@@ -12,6 +12,7 @@ PARTICULAR PURPOSE.
 """
 
 import threading
+import time
 
 class AudioBuffer():
   """Implements a simple audio buffer which allows for simple push and pull
@@ -20,6 +21,25 @@ class AudioBuffer():
      The implementation is agnostic of the sample rate, width and number
      of channels being used but will keep track of occupancy and number of
      dropped bytes from writes which occurred when the buffer was full.
+
+     Storage is a preallocated ring so that reads and writes only ever copy
+     the chunk being transferred rather than the whole buffer contents.
+
+     The buffer is intended for a single producer thread calling Write()
+     and a single consumer thread calling Read().  All bookkeeping is done
+     under a lock so that occupancy and counters are always consistent
+     when read from any other thread.
+
+     Optional low and high watermarks (in bytes) can be set.  Crossing a
+     watermark sets/clears the corresponding threading event and invokes
+     the watermark callback with 'low' or 'high', allowing producers to
+     back off when the buffer is nearly full and consumers to be notified
+     when it is nearly empty.
+
+     Leading silence may be queued with AddSilence().  It is held only as a
+     byte count and is returned by ReadInto() ahead of any buffered data,
+     from one shared zero buffer, so it costs no storage of its own and
+     does not count towards occupancy or totals.
   """
      
   # Dimension the buffer size based on some typical worst case params
@@ -29,53 +49,206 @@ class AudioBuffer():
   MAX_WIDTH = 2
   AUDIO_BUFFER_SIZE = MAX_SAMPLE_RATE*MAX_CHANNELS*MAX_WIDTH*SECONDS
 
-  def __init__(self, size=AUDIO_BUFFER_SIZE):
-    self.buf = ''
+  def __init__(self, size=AUDIO_BUFFER_SIZE, lowWatermark=0,
+               highWatermark=None):
+    self.buf = bytearray(size)
+    self.view = memoryview(self.buf)
+    self.head = 0         # Read position within the ring
+    self.occupancy = 0    # Number of bytes held in the ring
+    self.silence = 0      # Number of virtual silence bytes to read first
+    self.zeros = memoryview(bytearray(0))
     self.dropped = 0
     self.size = size
     self.total = 0
+    self.lock = threading.Lock()
+    self.levelChanged = threading.Condition(self.lock)
+    self.watermarkCallback = None
+    self.lowEvent = threading.Event()
+    self.highEvent = threading.Event()
+    self.SetWatermarks(lowWatermark, highWatermark)
+
+  def SetWatermarks(self, low=0, high=None):
+    """Set the low and high watermarks in bytes.  A high watermark of None
+       means the buffer capacity.
+    """
+    if (high is None):
+      high = self.size
+    with self.lock:
+      self.lowWatermark = low
+      self.highWatermark = high
+      crossed = self.__UpdateWatermarks()
+    self.__NotifyWatermarks(crossed)
+
+  def WatermarkCallback(self, callback):
+    """Register callback(level) invoked when the occupancy reaches the
+       'high' watermark or falls to the 'low' watermark
+    """
+    self.watermarkCallback = callback
+
+  def IsAboveHighWatermark(self):
+    """Tells us whether the occupancy is at or above the high watermark"""
+    return self.highEvent.is_set()
+
+  def IsBelowLowWatermark(self):
+    """Tells us whether the occupancy is at or below the low watermark"""
+    return self.lowEvent.is_set()
+
+  def WaitForOccupancy(self, nBytes, timeout):
+    """Wait for timeout until at least nBytes are held in the buffer.
+       Returns True if the occupancy was reached
+    """
+    deadline = time.time() + timeout
+    with self.lock:
+      while (self.occupancy < min(nBytes, self.size)):
+        remaining = deadline - time.time()
+        if (remaining <= 0):
+          return False
+        self.levelChanged.wait(remaining)
+    return True
+
+  def __UpdateWatermarks(self):
+    """Helper function to update watermark events, must be called with the
+       lock held.  Returns a list of watermarks newly crossed
+    """
+    crossed = []
+    if (self.occupancy >= self.highWatermark):
+      if (not self.highEvent.is_set()):
+        self.highEvent.set()
+        crossed.append('high')
+    else:
+      self.highEvent.clear()
+    if (self.occupancy <= self.lowWatermark):
+      if (not self.lowEvent.is_set()):
+        self.lowEvent.set()
+        crossed.append('low')
+    else:
+      self.lowEvent.clear()
+    return crossed
+
+  def __NotifyWatermarks(self, crossed):
+    """Helper function to invoke the watermark callback outside the lock"""
+    if (self.watermarkCallback):
+      for level in crossed:
+        self.watermarkCallback(level)
 
   def GetBufTotal(self):
     """Total number of bytes written since last flush"""
     return self.total
 
+  def GetBufConsumed(self):
+    """Total number of bytes read or discarded since last flush, i.e., the
+       read position in the stream of bytes written"""
+    with self.lock:
+      return self.total - self.occupancy
+
   def GetBufDropped(self):
     """Number of dropped bytes from write attempts to the buffer"""
     return self.dropped
 
   def GetBufOccupancy(self):
     """Current occupancy in bytes of the buffer"""
-    return len(self.buf)
+    return self.occupancy
 
   def GetBufSize(self):
     """Total size of the buffer i.e., capacity"""
     return self.size
 
+  def GetBufSilence(self):
+    """Number of virtual silence bytes still to be read"""
+    return self.silence
+
+  def AddSilence(self, nBytes):
+    """Queue nBytes of virtual silence to be read ahead of buffered data"""
+    with self.lock:
+      self.silence += nBytes
+
+  def GetBufAvailable(self):
+    """Free space in bytes remaining in the buffer"""
+    return self.size - self.occupancy
+
   def Write(self, data):
     """Write data to the buffer upto the available capacity.
        Returns the number of bytes written
     """
     wanted = len(data)
-    available = self.size - len(self.buf)
-    put = min(wanted, available)
-    self.buf += data[:put]
-    self.dropped += (wanted - put)
-    self.total += put
+    with self.lock:
+      available = self.size - self.occupancy
+      put = min(wanted, available)
+      if (put > 0):
+        src = memoryview(data)
+        tail = (self.head + self.occupancy) % self.size
+        first = min(put, self.size - tail)
+        self.view[tail:tail+first] = src[0:first]
+        if (put > first):
+          # Wrap around to the start of the ring
+          self.view[0:put-first] = src[first:put]
+        self.occupancy += put
+        self.levelChanged.notify_all()
+      self.dropped += (wanted - put)
+      self.total += put
+      crossed = self.__UpdateWatermarks()
+    self.__NotifyWatermarks(crossed)
     return put
 
   def Read(self, wanted):
     """Read data from the buffer upto the wanted number of bytes, removing
        that data from the buffer.
        Returns the data read as a string.  Its size can be ascertained
-       using len(data), for example
+       using len(data), for example.  This allocates the string returned,
+       use ReadInto() where nothing must be allocated, e.g., in real-time
+    """
+    data = bytearray(wanted)
+    read = self.ReadInto(data)
+    del data[read:]
+    return bytes(data)
+
+  def ReadInto(self, dest):
+    """Read data from the buffer into a preallocated writable buffer (e.g.,
+       a bytearray or memoryview) upto its length, removing that data from
+       the buffer.  No new storage is allocated for the data.
+       Returns the number of bytes read into dest
     """
-    available = len(self.buf)
-    take = min(wanted, available)
-    data = self.buf[0:take]
-    self.buf = self.buf[take:]
-    return data
+    dest = memoryview(dest)
+    wanted = len(dest)
+    with self.lock:
+      silent = min(wanted, self.silence)
+      if (silent > 0):
+        self.silence -= silent
+        if (len(self.zeros) < silent):
+          self.zeros = memoryview(bytearray(silent))
+        dest[0:silent] = self.zeros[0:silent]
+      take = min(wanted - silent, self.occupancy)
+      first = min(take, self.size - self.head)
+      dest[silent:silent+first] = self.view[self.head:self.head+first]
+      if (take > first):
+        # Wrap around to the start of the ring
+        dest[silent+first:silent+take] = self.view[0:take-first]
+      self.head = (self.head + take) % self.size
+      self.occupancy -= take
+      crossed = self.__UpdateWatermarks()
+    self.__NotifyWatermarks(crossed)
+    return silent + take
+
+  def Discard(self):
+    """Discards any buffered data but keeps the totals, e.g., when the
+       stream being buffered jumps to a new position.
+       Returns the number of bytes discarded
+    """
+    with self.lock:
+      discarded = self.occupancy
+      self.head = 0
+      self.occupancy = 0
+      self.silence = 0
+      crossed = self.__UpdateWatermarks()
+    self.__NotifyWatermarks(crossed)
+    return discarded
 
   def Flush(self):
     """Flushes (empties) the buffer"""
-    self.total = 0
-    self.buf = ''
+    with self.lock:
+      self.total = 0
+      self.head = 0
+      self.occupancy = 0
+      self.silence = 0
+      crossed = self.__UpdateWatermarks()
+    self.__NotifyWatermarks(crossed)
@@ -0,0 +1,123 @@
+"""
+AudioConverter
+
+Sample-rate and channel conversion stage for 16-bit PCM audio so that the
+audio pipeline can run at one fixed output format.
+
+Copyright (c) 2014 All Right Reserved, Liam Wickins
+
+Please see the LICENSE file for more information.
+
+THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+PARTICULAR PURPOSE.
+"""
+
+from __future__ import division
+from __future__ import print_function
+import numpy
+import time
+
+class AudioConverterUnsupportedFormat:
+  """Exception raised when an input sample width is not supported"""
+  pass
+
+class AudioConverter():
+  """Converts native endian int16 audio of any rate and channel count into
+     a fixed output rate and channel count using NumPy.
+
+     Resampling uses linear interpolation.  State is carried between calls
+     so that successive chunks of a stream join up without discontinuities;
+     call Reset() when the stream is interrupted (e.g., a new track).
+  """
+
+  WIDTH = 2
+
+  def __init__(self, rate=44100, channels=2):
+    self.rate = rate
+    self.channels = channels
+    self.Reset()
+
+  def Reset(self):
+    """Forget any state carried over from the previous chunk"""
+    self.last = None          # Last input frame of the previous chunk
+    self.pos = 0.0            # Next output position relative to self.last
+    self.inRate = None
+
+  def GetOutputFormat(self):
+    """Output audio format as a dict"""
+    return { 'width': self.WIDTH,
+             'rate': self.rate,
+             'channels': self.channels,
+             'frame_size': self.WIDTH * self.channels }
+
+  def GetInputFrames(self, outFrames, inFormat):
+    """Number of input frames which are guaranteed to convert into no more
+       than outFrames output frames"""
+    return max(0, ((outFrames - 2) * inFormat['rate']) // self.rate)
+
+  def Convert(self, data, inFormat):
+    """Convert a buffer of whole input frames described by inFormat (as per
+       GetOutputFormat()) into the output format.  Returns the converted
+       data as a string"""
+    if (inFormat['width'] != self.WIDTH):
+      raise AudioConverterUnsupportedFormat
+    if (len(data) == 0 or
+        (inFormat['rate'] == self.rate and inFormat['channels'] == self.channels)):
+      return data
+
+    # A change of input rate starts a new stream
+    if (inFormat['rate'] != self.inRate):
+      self.Reset()
+      self.inRate = inFormat['rate']
+
+    x = numpy.frombuffer(data, dtype=numpy.int16)
+    x = x.reshape(-1, inFormat['channels']).astype(numpy.float32)
+    x = self.__ConvertChannels(x)
+    if (inFormat['rate'] != self.rate):
+      x = self.__Resample(x, inFormat['rate'])
+    return x.astype(numpy.int16).tobytes()
+
+  def __ConvertChannels(self, x):
+    """Helper function to mix down or duplicate channels"""
+    inChannels = x.shape[1]
+    if (inChannels == self.channels):
+      return x
+    mono = x.mean(axis=1, keepdims=True)
+    return numpy.repeat(mono, self.channels, axis=1)
+
+  def __Resample(self, x, inRate):
+    """Helper function to linearly interpolate frames to the output rate"""
+    if (self.last is not None):
+      x = numpy.vstack((self.last, x))
+    self.last = x[-1:]
+    step = inRate / self.rate
+    span = len(x) - 1 - self.pos
+    if (span <= 0):
+      self.pos -= len(x) - 1
+      return x[0:0]
+    count = int(numpy.ceil(span / step))
+    positions = self.pos + step * numpy.arange(count)
+    index = positions.astype(numpy.int32)
+    frac = (positions - index)[:, numpy.newaxis].astype(numpy.float32)
+    self.pos = positions[-1] + step - (len(x) - 1)
+    return x[index] * (1 - frac) + x[index + 1] * frac
+
+def Benchmark(inRate=48000, seconds=10, chunkFrames=2048):
+  """Measure conversion throughput in samples per second"""
+  converter = AudioConverter()
+  inFormat = { 'width': 2, 'rate': inRate, 'channels': 2, 'frame_size': 4 }
+  t = numpy.arange(chunkFrames * 2) / 2
+  chunk = (numpy.sin(t) * 10000).astype(numpy.int16).tobytes()
+  chunks = (inRate * seconds) // chunkFrames
+  start = time.time()
+  for i in range(chunks):
+    converter.Convert(chunk, inFormat)
+  elapsed = time.time() - start
+  samples = chunks * chunkFrames * inFormat['channels']
+  return samples / elapsed
+
+if __name__ == '__main__':
+  for inRate in [22050, 32000, 48000, 96000]:
+    print("%d Hz -> 44100 Hz: %.0f samples/s" % (inRate, Benchmark(inRate)))
@@ -0,0 +1,244 @@
+"""
+AudioSink
+
+Audio sink interface together with sinks which need no audio hardware: a
+null sink and a WAV/raw file sink, both driven by a clock thread.
+
+Copyright (c) 2014 All Right Reserved, Liam Wickins
+
+Please see the LICENSE file for more information.
+
+THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+PARTICULAR PURPOSE.
+"""
+
+import threading
+import time
+import wave
+
+class AudioSink():
+  """Base class for audio sinks which pull audio from an AudioBuffer one
+     period at a time.
+
+     Subclasses drive FillPeriod() from their own clock (e.g., a sound device
+     callback) and implement Start(), Stop() and Exit().  Pausing, underrun
+     counting, an optional in place processing stage and callback timing are
+     common to all sinks.
+  """
+
+  FRAMES_PER_BUFFER = 8192
+
+  def __init__(self, buf, width, channels, rate, processor=None):
+    self.buffer = buf
+    self.processor = processor
+    self.rate = rate
+    self.channels = channels
+    self.width = width
+    self.streamPaused = False
+    self.streamActive = False
+
+    # Track number of audio underruns
+    self.underruns = 0
+
+    # Preallocated period buffers, sized for the default period
+    self.__AllocateScratch(self.FRAMES_PER_BUFFER * channels * width)
+
+    # Track callback execution times
+    self.callbackCount = 0
+    self.callbackTime = 0.0
+    self.callbackMaxTime = 0.0
+    self.callbackOverruns = 0
+
+  def Configure(self, buf, width, channels, rate):
+    """Switch the buffer feeding the sink.  The sink is only reformatted if
+       the audio format has changed.  The sink must be stopped when calling
+       this.
+    """
+    self.buffer = buf
+    if ((width, channels, rate) != (self.width, self.channels, self.rate)):
+      self.rate = rate
+      self.channels = channels
+      self.width = width
+      self.Reformat()
+
+  def Reformat(self):
+    """Called when the audio format changes, override to reopen outputs"""
+    pass
+
+  def __AllocateScratch(self, nBytes):
+    """Helper function to preallocate the buffers used each period.  Sinks
+       copy the returned data out before the next period, so the same
+       scratch buffer can be handed back every time"""
+    self.scratch = bytearray(nBytes)
+    self.scratchView = memoryview(self.scratch)
+    self.silenceView = memoryview(bytearray(nBytes))
+
+  def FillPeriod(self, frameCount, underflow=False):
+    """Fill and return the scratch buffer with frameCount frames of audio,
+       substituting silence when paused or on underrun.  This runs in
+       real-time so it must not allocate anything in the normal case"""
+    start = time.time()
+
+    # Consume data from the buffer -- we may not get what we requested
+    wanted = frameCount * self.channels * self.width
+    if (len(self.scratch) != wanted):
+      self.__AllocateScratch(wanted)
+    if (self.streamPaused):
+      actual = 0
+    else:
+      actual = self.buffer.ReadInto(self.scratchView)
+
+    # Track any underrun events
+    if (underflow or actual < wanted):
+      self.underruns += 1
+      # Substitute silence
+      self.scratchView[actual:wanted] = self.silenceView[actual:wanted]
+
+    # Apply any processing stage (e.g., software volume) in place to 16-bit
+    # samples
+    if (self.processor and actual > 0 and self.width == 2):
+      self.processor.Process(self.scratch, self.channels, self.rate)
+
+    # Track callback execution time against the period it must fill
+    elapsed = time.time() - start
+    self.callbackCount += 1
+    self.callbackTime += elapsed
+    self.callbackMaxTime = max(self.callbackMaxTime, elapsed)
+    if (elapsed * self.rate > frameCount):
+      self.callbackOverruns += 1
+
+    return self.scratch
+
+  def IsPlaying(self):
+    return not self.streamPaused
+
+  def IsActive(self):
+    """Tells us whether the sink has been started and not stopped"""
+    return self.streamActive
+
+  def Pause(self):
+    """Pause audio output"""
+    self.streamPaused = True
+
+  def Resume(self):
+    """Resume audio output"""
+    self.streamPaused = False
+
+  def GetLatency(self):
+    """Time in seconds between audio being taken from the buffer and it
+       being heard, override for sinks with output buffering"""
+    return 0.0
+
+  def GetNumUnderruns(self):
+    """Returns the number of underrun events that have happened"""
+    return self.underruns
+
+  def GetCallbackStats(self):
+    """Returns callback execution time statistics in milliseconds and the
+       number of callbacks which took longer than their period"""
+    if (self.callbackCount > 0):
+      mean = (self.callbackTime * 1000) / self.callbackCount
+    else:
+      mean = 0
+    return { 'count': self.callbackCount,
+             'mean': mean,
+             'max': self.callbackMaxTime * 1000,
+             'overruns': self.callbackOverruns }
+
+class ClockedAudioSink(AudioSink):
+  """Audio sink driven by a clock thread which fills one period at a time
+     and passes it to Output().  A speed greater than 1 runs the clock
+     faster than real time, which allows soak testing of buffering and
+     underrun behaviour without audio hardware.
+  """
+
+  def __init__(self, buf, width, channels, rate, processor=None, speed=1.0):
+    AudioSink.__init__(self, buf, width, channels, rate, processor)
+    self.speed = speed
+    self.thread = None
+    self.stopEvent = threading.Event()
+
+  def __Run(self):
+    """Clock thread which outputs a period each period interval"""
+    nextTime = time.time()
+    while (not self.stopEvent.is_set()):
+      self.Output(self.FillPeriod(self.FRAMES_PER_BUFFER))
+      nextTime += self.FRAMES_PER_BUFFER / (float(self.rate) * self.speed)
+      delay = nextTime - time.time()
+      if (delay > 0):
+        self.stopEvent.wait(delay)
+      else:
+        nextTime = time.time()   # Fallen behind, don't try to catch up
+
+  def Output(self, data):
+    """Deliver a period of audio, override to do something with it"""
+    pass
+
+  def Start(self):
+    """Start the clock thread"""
+    self.Stop()
+    self.Resume()
+    self.stopEvent.clear()
+    self.thread = threading.Thread(target=self.__Run)
+    self.thread.daemon = True
+    self.thread.start()
+    self.streamActive = True
+
+  def Stop(self, wait=True, timeout=1):
+    """Stop the clock thread"""
+    self.streamActive = False
+    self.Pause()
+    self.stopEvent.set()
+    if (wait and self.thread):
+      self.thread.join(timeout)
+      self.thread = None
+
+  def Exit(self):
+    """Clean-up everything"""
+    self.Stop()
+
+class NullAudioSink(ClockedAudioSink):
+  """Audio sink which consumes audio at the clock rate and discards it"""
+  pass
+
+class FileAudioSink(ClockedAudioSink):
+  """Audio sink which records audio to a file at the clock rate.  Files
+     ending '.wav' are written as WAV, otherwise raw PCM is written.  A
+     change of audio format starts the file again.
+  """
+
+  def __init__(self, buf, width, channels, rate, processor=None, speed=1.0,
+               fileName='/tmp/spotify.wav'):
+    ClockedAudioSink.__init__(self, buf, width, channels, rate, processor,
+                              speed)
+    self.fileName = fileName
+    self.lock = threading.Lock()
+    self.__Open()
+
+  def __Open(self):
+    """Helper function to open the output file for the audio format"""
+    if (self.fileName.endswith('.wav')):
+      self.file = wave.open(self.fileName, 'wb')
+      self.file.setsampwidth(self.width)
+      self.file.setnchannels(self.channels)
+      self.file.setframerate(self.rate)
+      self.write = self.file.writeframes
+    else:
+      self.file = open(self.fileName, 'wb')
+      self.write = self.file.write
+
+  def Reformat(self):
+    with self.lock:
+      self.file.close()
+      self.__Open()
+
+  def Output(self, data):
+    with self.lock:
+      self.write(data)
+
+  def Exit(self):
+    ClockedAudioSink.Exit(self)
+    with self.lock:
+      self.file.close()
@@ -13,52 +13,55 @@ PARTICULAR PURPOSE.
 
 import threading
 import pyaudio
+from AudioSink import AudioSink
 
-class AudioStream():
+class AudioStream(AudioSink):
   """A simple wrapper around PyAudio which uses the callback mechanism
      (i.e., non-blocking) to drive audio data into the sound device.
+
+     The PyAudio instance and output device are long-lived.  Starting and
+     stopping the stream between tracks keeps the device open, and the
+     device is only reopened by Configure() if the audio format changes.
   """
-  def __init__(self, buf, width, channels, rate):
+
+  def __init__(self, buf, width, channels, rate, processor=None):
+    AudioSink.__init__(self, buf, width, channels, rate, processor)
 
     # Setup PyAudio and open a stream with the required audio properties
     self.p = pyaudio.PyAudio()
-    self.stream = self.p.open(format=self.p.get_format_from_width(width),
-                              channels=channels,
-                              output=True,
-                              rate=rate,
-                              frames_per_buffer=8192,
-                              stream_callback=self.__RequestSamplesCallback)
-    self.rate = rate
-    self.channels = channels
-    self.width = width
-    self.buffer = buf
-    self.streamPaused = False
+    self.stream = None
+    self.periodFrames = 0
+    self.__Open()
     self.defaultFlag = pyaudio.paContinue    # Used by callback handler
 
     # Create threading event for paComplete event delivery
     self.completeEvent = threading.Event()
 
-    # Track number of audio hardware underruns
-    self.underruns = 0
+  def __Open(self):
+    """Helper function to open the output device for the audio format"""
+    self.stream = self.p.open(format=self.p.get_format_from_width(self.width),
+                              channels=self.channels,
+                              output=True,
+                              rate=self.rate,
+                              frames_per_buffer=self.FRAMES_PER_BUFFER,
+                              start=False,
+                              stream_callback=self.__RequestSamplesCallback)
+
+  def Reformat(self):
+    """Reopen the output device for a new audio format"""
+    self.stream.close()
+    self.__Open()
 
   def __RequestSamplesCallback(self, notUsed, frameCount, timeInfo, statusFlags):
     """Main callback routine invoked by PyAudio which must deliver data
-       and any status flags into the audio driver"""
-
-    # Consume data from the buffer -- we may not get what we requested
-    wanted = frameCount * self.channels * self.width
-    if (self.streamPaused):
-      opData = self.__GenerateSilence(wanted)
-    else:
-      opData = self.buffer.Read(wanted)
+       and any status flags into the audio driver.  The Python 2 binding
+       only accepts a str (or read-only buffer), not the scratch bytearray,
+       so the period is copied once into a str"""
 
-    # Record actual length
-    actual = len(opData)
-
-    # Track any underrun events
-    if (statusFlags == pyaudio.paOutputUnderflow or actual < wanted):
-      self.underruns += 1
-      opData += self.__GenerateSilence(wanted-actual) # Substitute silence
+    # Consume data from the buffer into the scratch buffer
+    self.periodFrames = frameCount
+    opData = self.FillPeriod(frameCount,
+                             statusFlags == pyaudio.paOutputUnderflow)
 
     # The default flag is paContinue or paComplete.
     # paContinue is the starting condition whereas paComplete is when we're
@@ -69,32 +72,30 @@ class AudioStream():
     if (opFlag == pyaudio.paComplete):
       self.completeEvent.set()
 
-    #print "Wanted:", wanted, "Actual:", actual, "Flag:", opFlag, "Drops:", self.underruns
+    #print "Frames:", frameCount, "Flag:", opFlag, "Drops:", self.underruns
+
+    return (bytes(opData), opFlag)
 
-    return (opData, opFlag)
+  def GetLatency(self):
+    """Output device latency plus the period most recently handed to it"""
+    return (self.stream.get_output_latency() +
+            self.periodFrames / float(self.rate))
 
   def Start(self):
     """Start the audio stream playing"""
     self.Resume()
     self.defaultFlag = pyaudio.paContinue    # Used by callback handler
+    self.completeEvent.clear()
+    # A stream which didn't complete in time when stopped must be stopped
+    # before it can be restarted
+    if (not self.stream.is_stopped()):
+      self.stream.stop_stream()
     self.stream.start_stream()
-
-  def __GenerateSilence(self, wanted):
-    return chr(0) * wanted
-
-  def IsPlaying(self):
-    return not self.streamPaused
-
-  def Pause(self):
-    """Pause audio stream"""
-    self.streamPaused = True
-
-  def Resume(self):
-    """Resume audio stream"""
-    self.streamPaused = False
+    self.streamActive = True
 
   def Stop(self, wait=True, timeout=1):
     """Stop the audio stream playing"""
+    self.streamActive = False
     self.Pause()                             # Do not output normal frames
     self.defaultFlag = pyaudio.paComplete       # Used by callback handler
     # The caller is optionally allowed to wait for the paComplete event being
@@ -104,13 +105,9 @@ class AudioStream():
         self.completeEvent.clear()
         self.stream.stop_stream()
 
-  def GetNumUnderruns(self):
-    """Returns the number of underrun events that have happened"""
-    return self.underruns
-
   def Exit(self):
     """Clean-up everything"""
-    self.Stop()
+    if (self.streamActive):
+      self.Stop()
     self.stream.close()
     self.p.terminate()
-
@@ -0,0 +1,90 @@
+"""
+AudioVolume
+
+In-process software volume, mute and fade stage for 16-bit PCM audio.
+
+Copyright (c) 2014 All Right Reserved, Liam Wickins
+
+Please see the LICENSE file for more information.
+
+THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+PARTICULAR PURPOSE.
+"""
+
+from __future__ import division
+import numpy
+
+class AudioVolume():
+  """Applies gain and mute to native endian int16 frames in place using
+     NumPy, so that a volume change takes effect on the next audio
+     callback rather than going through the sound server.
+
+     Volume is a percentage from 0 to 100 which is mapped onto a cubic gain
+     curve, as PulseAudio does, so that steps sound even.  Gain changes
+     (including mute and unmute) are ramped over fadeMs to avoid clicks.
+  """
+
+  def __init__(self, volume=100, fadeMs=50):
+    self.fadeMs = fadeMs
+    self.muted = False
+    self.current = None       # Gain applied at the end of the last frame
+    self.SetVolume(volume)
+    self.current = self.gain
+
+  @staticmethod
+  def __VolumeToGain(volume):
+    """Helper function to map volume percentage onto a cubic gain curve"""
+    return (volume / 100.0) ** 3
+
+  def SetVolume(self, volume):
+    """Set volume level as a percentage 0 to 100"""
+    self.volume = max(0, min(100, int(volume)))
+    self.gain = AudioVolume.__VolumeToGain(self.volume)
+
+  def GetVolume(self):
+    """Current volume level as a percentage"""
+    return self.volume
+
+  def Mute(self):
+    self.muted = True
+
+  def Unmute(self):
+    self.muted = False
+
+  def IsMuted(self):
+    return self.muted
+
+  def Process(self, data, channels, rate):
+    """Apply the current gain in place to a writable buffer (e.g., a
+       bytearray) of native endian int16 frames"""
+    if (self.muted):
+      target = 0.0
+    else:
+      target = self.gain
+
+    # Nothing to do at unity gain once any fade has finished
+    if (target == 1.0 and self.current == 1.0):
+      return
+
+    frames = numpy.frombuffer(data, dtype=numpy.int16).reshape(-1, channels)
+    if (len(frames) == 0):
+      return
+    if (target == self.current):
+      numpy.multiply(frames, target, out=frames, casting='unsafe')
+      return
+
+    # Ramp the gain at a rate which takes fadeMs for a full scale change
+    step = 1000.0 / max(1, self.fadeMs * rate)
+    count = int(numpy.ceil(abs(target - self.current) / step))
+    ramp = min(count, len(frames))
+    if (target < self.current):
+      step = -step
+    gains = self.current + step * numpy.arange(1, ramp + 1)
+    if (ramp == count):
+      gains[-1] = target              # Land exactly on the target gain
+    numpy.multiply(frames[:ramp], gains[:, numpy.newaxis], out=frames[:ramp],
+                   casting='unsafe')
+    numpy.multiply(frames[ramp:], target, out=frames[ramp:], casting='unsafe')
+    self.current = gains[-1]
@@ -0,0 +1,147 @@
+"""
+CommandExecutor
+
+Runs commands one at a time, in order, on a single thread.
+
+Copyright (c) 2014 All Right Reserved, Liam Wickins
+
+Please see the LICENSE file for more information.
+
+THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+PARTICULAR PURPOSE.
+"""
+
+from __future__ import print_function
+import Queue
+import sys
+import threading
+import time
+from collections import deque
+
+def Debug(*objs):
+  print("CommandExecutor:", *objs, file=sys.stderr)
+
+class CommandResult():
+  """The result of a submitted command, which can be waited for or have
+     callbacks added"""
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.lock = threading.Lock()
+    self.callbacks = []
+    self.result = None
+    self.error = None
+
+  def Set(self, result, error=None):
+    self.result = result
+    self.error = error
+    with self.lock:
+      self.done.set()
+      callbacks = self.callbacks
+      self.callbacks = []
+    for callback in callbacks:
+      try:
+        callback(self)
+      except Exception as e:
+        Debug("Callback failed:", e)
+
+  def AddCallback(self, callback):
+    """Call callback(commandResult) once the command has run, straight away
+       if it already has.  It may be called on the worker thread so must
+       not block"""
+    with self.lock:
+      if (not self.done.is_set()):
+        self.callbacks.append(callback)
+        return
+    callback(self)
+
+  def Wait(self, timeout=None):
+    """Wait for the command to run and return its result, re-raising any
+       exception it raised.  Returns None on timeout"""
+    if (not self.done.wait(timeout)):
+      return None
+    if (self.error):
+      raise self.error
+    return self.result
+
+class CommandExecutor():
+  """A single writer: commands which change shared state are queued and run
+     in the order submitted on one worker thread, so they never run
+     concurrently with each other.  Objects which must only be used from
+     one thread (e.g., a sqlite connection) can be created and used on the
+     worker with Call().
+
+     The time from submitting each command to it completing is kept per
+     command name so that latencies can be reported.
+  """
+
+  # Number of latencies kept per command name
+  LATENCY_HISTORY = 100
+
+  def __init__(self):
+    self.queue = Queue.Queue()
+    self.latencies = {}               # name -> deque of latencies in ms
+    self.count = 0
+    self.thread = threading.Thread(target=self.__Run, name='CommandExecutor')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def __Run(self):
+    while (True):
+      command = self.queue.get()
+      if (command is None):
+        break
+      self.__Execute(*command)
+
+  def __Execute(self, name, func, args, result, submitted):
+    """Helper function to run a command on the worker, recording its result
+       or exception and its latency"""
+    try:
+      (value, error) = (func(*args), None)
+    except Exception as e:
+      Debug("Command", name, "failed:", e)
+      (value, error) = (None, e)
+    result.Set(value, error)
+    latency = (time.time() - submitted) * 1000
+    if (name not in self.latencies):
+      self.latencies[name] = deque(maxlen=self.LATENCY_HISTORY)
+    self.latencies[name].append(latency)
+    self.count += 1
+
+  def Submit(self, name, func, *args):
+    """Queue func(*args) to run after the commands already queued.  Returns
+       a CommandResult"""
+    result = CommandResult()
+    command = (name, func, args, result, time.time())
+    if (threading.current_thread() is self.thread):
+      # Already on the worker, so queueing would deadlock anyone waiting
+      self.__Execute(*command)
+    else:
+      self.queue.put(command)
+    return result
+
+  def Call(self, name, func, *args):
+    """Run func(*args) on the worker and wait for its result"""
+    return self.Submit(name, func, *args).Wait()
+
+  def GetStats(self):
+    """Number of commands run and waiting, and percentiles of the time in
+       milliseconds taken by recent commands of each name"""
+    stats = { 'count': self.count, 'pending': self.queue.qsize(),
+              'latency': {} }
+    for (name, latencies) in self.latencies.items():
+      latencies = sorted(latencies)
+      def Percentile(percent):
+        return latencies[min(len(latencies) - 1,
+                             (len(latencies) * percent) // 100)]
+      stats['latency'][name] = { 'p50': Percentile(50),
+                                 'p90': Percentile(90),
+                                 'p99': Percentile(99),
+                                 'max': Percentile(100) }
+    return stats
+
+  def Exit(self):
+    self.queue.put(None)
+    self.thread.join()
@@ -0,0 +1,106 @@
+"""
+EventStream
+
+Broadcasts player events to any number of listeners, e.g., web clients
+on a server-sent event stream.
+
+Copyright (c) 2014 All Right Reserved, Liam Wickins
+
+Please see the LICENSE file for more information.
+
+THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+PARTICULAR PURPOSE.
+"""
+
+import json
+import threading
+from collections import deque
+
+class EventStream():
+  """A stream of (id, name, data) events with increasing ids.
+
+     Events are published once and read by every listener, so the cost of
+     publishing doesn't grow with the number of listeners.  The last event
+     of each name is kept as the current state so a new listener can be
+     brought up to date, and the most recent events are kept so a listener
+     which reconnects can carry on from the last event it saw.
+
+     Listeners can either block in Wait() or add a watcher which is called
+     as each event is published, e.g., to wake an event loop.
+  """
+
+  def __init__(self, history=100):
+    self.cond = threading.Condition()
+    self.events = deque(maxlen=history)
+    self.state = {}                   # name -> last (id, name, data)
+    self.lastId = 0
+    self.listeners = 0
+    self.watchers = []
+
+  def Publish(self, name, data):
+    """Publish an event to all listeners"""
+    with self.cond:
+      self.lastId += 1
+      event = (self.lastId, name, data)
+      self.events.append(event)
+      self.state[name] = event
+      self.cond.notify_all()
+      for watcher in self.watchers:
+        watcher()
+
+  def Update(self, name, data):
+    """Publish an event only if its data has changed since the last event
+       of that name.  Returns True if it was published"""
+    with self.cond:
+      if (name in self.state and self.state[name][2] == data):
+        return False
+      self.Publish(name, data)
+      return True
+
+  def Listen(self, lastId=None):
+    """Events to bring a listener up to date, those after lastId if they
+       are known, otherwise the current state"""
+    with self.cond:
+      if (lastId is not None and lastId <= self.lastId and
+          (not self.events or self.events[0][0] <= lastId + 1)):
+        return [e for e in self.events if e[0] > lastId]
+      return sorted(self.state.values())
+
+  def Wait(self, lastId, timeout=None):
+    """Events after lastId, waiting upto timeout seconds for one.  Returns
+       an empty list on timeout"""
+    with self.cond:
+      if (self.lastId <= lastId):
+        self.cond.wait(timeout)
+      return self.Listen(lastId)
+
+  def AddWatcher(self, callback):
+    """Call callback() each time an event is published.  It is called with
+       the stream locked so it must not block or publish"""
+    with self.cond:
+      self.watchers.append(callback)
+
+  def RemoveWatcher(self, callback):
+    with self.cond:
+      self.watchers.remove(callback)
+
+  @staticmethod
+  def Format(event):
+    """Format an event as a server-sent event"""
+    (i, name, data) = event
+    return "id: %d\nevent: %s\ndata: %s\n\n" % (i, name, json.dumps(data))
+
+  def AddListener(self):
+    with self.cond:
+      self.listeners += 1
+
+  def RemoveListener(self):
+    with self.cond:
+      self.listeners -= 1
+
+  def GetStats(self):
+    """Number of listeners and events published"""
+    with self.cond:
+      return { 'listeners': self.listeners, 'published': self.lastId }
@@ -0,0 +1,426 @@
+"""
+FakeSpotify
+
+Simulated stand-in for the parts of the pyspotify API used by this
+project, so that SpotifyService, PlayQueue and SpotifyServer can be run,
+load-tested and benchmarked on a machine with no network, account or
+libspotify.
+
+Select it by setting the SPOTIFY_SIMULATOR environment variable, in which
+case modules import FakeSpotify in place of spotify.
+
+Searches return deterministic results derived from the query, track
+metadata is derived from the track URI and playback delivers a synthetic
+tone for each track.  The simulation is tuned through the settings dict,
+whose defaults can be overridden with environment variables:
+
+  SPOTIFY_SIMULATOR_SPEED     Delivery speed as a multiple of real time
+  SPOTIFY_SIMULATOR_JITTER    Maximum random delay per delivery in ms
+  SPOTIFY_SIMULATOR_FAILURE   Probability that a track never delivers audio
+  SPOTIFY_SIMULATOR_DURATION  Track duration in ms (0 for varied durations)
+  SPOTIFY_SIMULATOR_LATENCY   Search and login completion latency in ms
+  SPOTIFY_SIMULATOR_SEED      Seed for jitter and failure randomness
+
+Copyright (c) 2014 All Right Reserved, Liam Wickins
+
+Please see the LICENSE file for more information.
+
+THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+PARTICULAR PURPOSE.
+"""
+
+from __future__ import division
+import os
+import math
+import time
+import array
+import random
+import hashlib
+import threading
+from collections import deque
+
+settings = {
+  'speed': float(os.environ.get('SPOTIFY_SIMULATOR_SPEED', 4.0)),
+  'jitter': int(os.environ.get('SPOTIFY_SIMULATOR_JITTER', 0)),
+  'failure': float(os.environ.get('SPOTIFY_SIMULATOR_FAILURE', 0.0)),
+  'duration': int(os.environ.get('SPOTIFY_SIMULATOR_DURATION', 0)),
+  'latency': int(os.environ.get('SPOTIFY_SIMULATOR_LATENCY', 50)),
+  'seed': int(os.environ.get('SPOTIFY_SIMULATOR_SEED', 0)),
+  'rate': 44100,
+  'channels': 2,
+  'chunk': 2048,          # Frames per music delivery
+  'total': 200            # Number of results available for each search
+}
+
+generator = random.Random(settings['seed'])
+
+# A 1x1 pixel PNG used for every image
+PNG = ('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+       '1f15c4890000000d49444154789c6360606060000000050001a5f64540'
+       '0000000049454e44ae426082').decode('hex')
+
+class Error(Exception):
+  pass
+
+class Timeout(Error):
+  pass
+
+class SessionEvent:
+  LOGGED_IN = 'logged_in'
+  LOGGED_OUT = 'logged_out'
+  CONNECTION_ERROR = 'connection_error'
+  MESSAGE_TO_USER = 'message_to_user'
+  NOTIFY_MAIN_THREAD = 'notify_main_thread'
+  PLAY_TOKEN_LOST = 'play_token_lost'
+  STREAMING_ERROR = 'streaming_error'
+  MUSIC_DELIVERY = 'music_delivery'
+  START_PLAYBACK = 'start_playback'
+  STOP_PLAYBACK = 'stop_playback'
+  END_OF_TRACK = 'end_of_track'
+  GET_AUDIO_BUFFER_STATS = 'get_audio_buffer_stats'
+  METADATA_UPDATED = 'metadata_updated'
+
+class ConnectionState:
+  LOGGED_OUT = 0
+  LOGGED_IN = 1
+
+class ErrorType:
+  OK = 0
+  OTHER_TRANSIENT = 17
+
+class SampleType:
+  INT16_NATIVE_ENDIAN = 0
+
+class SearchType:
+  STANDARD = 0
+  SUGGEST = 1
+
+class ImageFormat:
+  UNKNOWN = -1
+  JPEG = 0
+
+class AudioBufferStats():
+  def __init__(self, samples, stutter):
+    self.samples = samples
+    self.stutter = stutter
+
+class AudioFormat():
+  def __init__(self, rate, channels):
+    self.sample_type = SampleType.INT16_NATIVE_ENDIAN
+    self.sample_rate = rate
+    self.channels = channels
+
+  def frame_size(self):
+    return 2 * self.channels
+
+def Digest(text):
+  """Deterministic hex digest used to derive identifiers and metadata"""
+  if (isinstance(text, unicode)):
+    text = text.encode('utf-8')
+  return hashlib.md5(text).hexdigest()
+
+class Link():
+  def __init__(self, uri):
+    self.uri = uri
+
+  def __repr__(self):
+    return 'Link(%r)' % self.uri
+
+class Config():
+  def __init__(self):
+    self.user_agent = None
+    self.tracefile = None
+
+class Image():
+  def __init__(self, uri):
+    self.link = Link(uri)
+    self.is_loaded = True
+    self.format = ImageFormat.UNKNOWN
+    self.data = PNG
+    self.data_uri = 'data:image/png;base64,' + PNG.encode('base64').strip()
+
+  def load(self, timeout=None):
+    return self
+
+class Artist():
+  def __init__(self, uri):
+    self.link = Link(uri)
+    self.is_loaded = True
+    self.name = 'Artist ' + uri.split(':')[-1][0:6]
+
+  def portrait(self):
+    return Image('spotify:image:' + Digest(self.link.uri))
+
+  def load(self, timeout=None):
+    return self
+
+class Album():
+  def __init__(self, uri):
+    h = uri.split(':')[-1]
+    self.link = Link(uri)
+    self.is_loaded = True
+    self.is_available = True
+    self.artist = Artist('spotify:artist:' + Digest(h[0:4]))
+    self.name = 'Album ' + h[0:6]
+    self.year = 1960 + int(h[0:4], 16) % 55
+    self.type = 0
+
+  def cover(self):
+    return Image('spotify:image:' + Digest(self.link.uri))
+
+  def load(self, timeout=None):
+    return self
+
+class Track():
+  """Track whose metadata is derived from its URI"""
+
+  def __init__(self, uri):
+    h = Digest(uri)
+    self.link = Link(uri)
+    self.is_loaded = True
+    self.error = ErrorType.OK
+    self.offline_status = 0
+    self.availability = 1
+    self.is_local = False
+    self.is_autolinked = False
+    self.playable = self
+    self.is_placeholder = False
+    self.starred = False
+    self.album = Album('spotify:album:' + h[0:8])
+    self.artists = [self.album.artist]
+    self.name = 'Track ' + h[0:6]
+    if (settings['duration'] > 0):
+      self.duration = settings['duration']
+    else:
+      self.duration = 60000 + int(h[0:4], 16) % 240000
+    self.popularity = int(h[4:6], 16) % 100
+    self.disc = 1
+    self.index = 1 + int(h[6:8], 16) % 12
+    self.frequency = 220 + int(h[8:10], 16)   # Tone used for its audio
+
+  def load(self, timeout=None):
+    return self
+
+  def __eq__(self, other):
+    return isinstance(other, Track) and self.link.uri == other.link.uri
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+class Search():
+  """Search whose results are derived from the query and offsets"""
+
+  def __init__(self, session, query, callback, track_offset=0, track_count=20,
+               album_offset=0, album_count=20, artist_offset=0,
+               artist_count=20, playlist_offset=0, playlist_count=20,
+               search_type=SearchType.STANDARD):
+    self.session = session
+    self.query = query
+    self.callback = callback
+    self.args = { 'track_offset': track_offset, 'track_count': track_count,
+                  'album_offset': album_offset, 'album_count': album_count,
+                  'artist_offset': artist_offset,
+                  'artist_count': artist_count,
+                  'playlist_offset': playlist_offset,
+                  'playlist_count': playlist_count,
+                  'search_type': search_type }
+    self.is_loaded = False
+    self.error = ErrorType.OK
+    self.did_you_mean = ''
+    self.link = Link('spotify:search:' + query.replace(' ', '+'))
+    self.tracks = self.__Items(Track, 'track', track_offset, track_count)
+    self.albums = self.__Items(Album, 'album', album_offset, album_count)
+    self.artists = self.__Items(Artist, 'artist', artist_offset, artist_count)
+    self.playlists = []
+    self.track_total = settings['total']
+    self.album_total = settings['total']
+    self.artist_total = settings['total']
+    self.playlist_total = 0
+    session.Post(self.__Complete, delay=settings['latency'])
+
+  def __Items(self, cls, kind, offset, count):
+    """Helper function to make deterministic results for the query"""
+    last = min(offset + count, settings['total'])
+    return [cls('spotify:' + kind + ':' + Digest(self.query + str(i)))
+            for i in range(offset, last)]
+
+  def __Complete(self):
+    self.is_loaded = True
+    if (self.callback):
+      self.callback(self)
+
+  def more(self, callback=None):
+    args = dict(self.args)
+    for i in ['track', 'album', 'artist', 'playlist']:
+      args[i+'_offset'] += args[i+'_count']
+    return Search(self.session, self.query, callback or self.callback, **args)
+
+  def load(self, timeout=None):
+    return self
+
+class Player():
+  """Player which delivers a synthetic tone for the loaded track from its
+     own thread, as libspotify does, honouring partial consumption of
+     deliveries and emitting END_OF_TRACK at the end of the track"""
+
+  def __init__(self, session):
+    self.session = session
+    self.track = None
+    self.position = 0                 # Frames delivered so far
+    self.thread = None
+    self.stopEvent = threading.Event()
+    self.playing = threading.Event()
+    self.lock = threading.Lock()
+
+  def load(self, track):
+    self.unload()
+    with self.lock:
+      self.track = track
+      self.position = 0
+      self.tone = self.__Tone(track)
+
+  def prefetch(self, track):
+    pass
+
+  def play(self, play=True):
+    if (not play):
+      self.playing.clear()
+      return
+    self.playing.set()
+    if (self.track and not self.thread):
+      self.stopEvent.clear()
+      self.thread = threading.Thread(target=self.__Run)
+      self.thread.daemon = True
+      self.thread.start()
+
+  def pause(self):
+    self.play(False)
+
+  def seek(self, offset):
+    """Seek to offset in ms"""
+    with self.lock:
+      self.position = (offset * settings['rate']) // 1000
+    self.session.Emit(SessionEvent.MUSIC_DELIVERY,
+                      AudioFormat(settings['rate'], settings['channels']),
+                      '', 0)
+
+  def unload(self):
+    if (self.thread):
+      self.stopEvent.set()
+      self.playing.set()
+      if (self.thread is not threading.current_thread()):
+        self.thread.join()
+      self.thread = None
+      self.session.Emit(SessionEvent.STOP_PLAYBACK)
+    self.playing.clear()
+    self.track = None
+
+  @staticmethod
+  def __Tone(track):
+    """Helper function to make a second of the track's tone plus a chunk to
+       allow any chunk to be sliced out without wrapping"""
+    rate = settings['rate']
+    channels = settings['channels']
+    samples = array.array('h')
+    for i in range(rate + settings['chunk']):
+      v = int(8000 * math.sin(2 * math.pi * track.frequency * i / rate))
+      samples.extend([v] * channels)
+    return samples.tostring()
+
+  def __Run(self):
+    """Delivery thread"""
+    rate = settings['rate']
+    channels = settings['channels']
+    frameSize = 2 * channels
+    audioFormat = AudioFormat(rate, channels)
+    total = (self.track.duration * rate) // 1000
+    if (generator.random() < settings['failure']):
+      return                          # Simulate a track which never plays
+    self.session.Emit(SessionEvent.START_PLAYBACK)
+    while (not self.stopEvent.is_set()):
+      self.playing.wait()
+      if (self.stopEvent.is_set()):
+        break
+      with self.lock:
+        position = self.position
+        count = min(settings['chunk'], total - position)
+        start = (position % rate) * frameSize
+        frames = self.tone[start:start + count * frameSize]
+      if (count <= 0):
+        break
+      consumed = self.session.Emit(SessionEvent.MUSIC_DELIVERY, audioFormat,
+                                   frames, count) or 0
+      with self.lock:
+        if (self.position == position):
+          self.position += consumed
+      delay = count / (rate * settings['speed'])
+      if (settings['jitter'] > 0):
+        delay += generator.uniform(0, settings['jitter']) / 1000
+      self.stopEvent.wait(delay)
+    if (not self.stopEvent.is_set()):
+      self.session.Emit(SessionEvent.END_OF_TRACK)
+
+class Session():
+  """Session which dispatches events in the same way as pyspotify: audio
+     events from the player thread and everything else from
+     process_events() on the caller's thread"""
+
+  def __init__(self, config=None):
+    self.config = config
+    self.connection_state = ConnectionState.LOGGED_OUT
+    self.listeners = {}
+    self.pending = deque()
+    self.lock = threading.Lock()
+    self.player = Player(self)
+
+  def on(self, event, listener, *userArgs):
+    self.listeners.setdefault(event, []).append((listener, userArgs))
+
+  def Emit(self, event, *args):
+    """Invoke listeners for an event, returning the last listener result"""
+    result = None
+    for (listener, userArgs) in self.listeners.get(event, []):
+      result = listener(*((self,) + args + userArgs))
+    return result
+
+  def Post(self, func, delay=0):
+    """Queue func to be called from process_events() after delay ms"""
+    with self.lock:
+      self.pending.append((time.time() + delay / 1000, func))
+    if (delay > 0):
+      timer = threading.Timer(delay / 1000, self.Emit,
+                              [SessionEvent.NOTIFY_MAIN_THREAD])
+      timer.daemon = True
+      timer.start()
+    else:
+      self.Emit(SessionEvent.NOTIFY_MAIN_THREAD)
+
+  def process_events(self):
+    """Run any due work and return the time in ms until more is due"""
+    now = time.time()
+    with self.lock:
+      due = [f for (t, f) in self.pending if t <= now]
+      self.pending = deque([(t, f) for (t, f) in self.pending if t > now])
+      later = [t for (t, f) in self.pending]
+    for func in due:
+      func()
+    if (later):
+      return max(0, int(math.ceil((min(later) - now) * 1000)))
+    return 1000
+
+  def login(self, username, password, remember_me=False, blob=None):
+    def LoggedIn():
+      self.connection_state = ConnectionState.LOGGED_IN
+      self.Emit(SessionEvent.LOGGED_IN, ErrorType.OK)
+    self.Post(LoggedIn, delay=settings['latency'])
+
+  def logout(self):
+    def LoggedOut():
+      self.connection_state = ConnectionState.LOGGED_OUT
+      self.Emit(SessionEvent.LOGGED_OUT)
+    self.Post(LoggedOut)
+
+  def search(self, query, callback=None, **kwargs):
+    return Search(self, query, callback, **kwargs)
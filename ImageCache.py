@@ -0,0 +1,209 @@
+"""
+ImageCache
+
+A bounded in-memory and on-disk cache of images (e.g., album art) keyed
+by URI, holding each image alongside pre-scaled thumbnails.
+
+Copyright (c) 2014 All Right Reserved, Liam Wickins
+
+Please see the LICENSE file for more information.
+
+THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+PARTICULAR PURPOSE.
+"""
+
+from __future__ import print_function
+import hashlib
+import io
+import os
+import sys
+import threading
+from LruCache import LruCache
+
+# Thumbnails need PIL
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+
+def Debug(*objs):
+  print("ImageCache:", *objs, file=sys.stderr)
+
+class CachedImage():
+  """An image's data together with its content type and entity tag"""
+
+  def __init__(self, data, contentType):
+    self.data = data
+    self.contentType = contentType
+    self.etag = '"' + hashlib.md5(data).hexdigest() + '"'
+
+class ImageCache():
+  """Caches images fetched by loader(uri), which returns the image data or
+     None.  Upto memorySize images are held in memory and upto diskSize on
+     disk in directory, each evicting the least recently used.
+
+     When an image is first fetched a thumbnail is made for each of
+     thumbnailSizes (the longest side in pixels), so thumbnails never have
+     to be scaled on request.  Images are only fetched once however many
+     sizes are asked for, or however many requests for it arrive at once.
+     Without PIL the full size image is given for every size.
+  """
+
+  # Number of recently fetched images whose sizes are all kept together,
+  # so that concurrent requests for an image share one fetch
+  RECENT_FETCHES = 16
+
+  def __init__(self, loader, directory='/tmp/spotify-images', memorySize=256,
+               diskSize=4096, thumbnailSizes=None):
+    self.loader = loader
+    self.directory = directory
+    self.diskSize = diskSize
+    if (thumbnailSizes is None):
+      thumbnailSizes = [64]
+    self.thumbnailSizes = thumbnailSizes
+    # Failed loads aren't cached
+    self.memory = LruCache(memorySize, valid=lambda image: image is not None)
+    self.recentFetches = LruCache(self.RECENT_FETCHES,
+                                  valid=lambda images: images is not None)
+    self.lock = threading.Lock()
+    self.fetches = 0
+    self.diskHits = 0
+    if (not os.path.isdir(directory)):
+      os.makedirs(directory)
+    self.diskCount = len(os.listdir(directory))
+
+  def IsSizeValid(self, size):
+    """Tells us whether size is one which is cached, None for full size is
+       always valid"""
+    return size is None or size in self.thumbnailSizes
+
+  @staticmethod
+  def __ContentType(data):
+    """Helper function to find an image's content type from its data"""
+    if (data.startswith(b'\x89PNG')):
+      return 'image/png'
+    return 'image/jpeg'
+
+  def __FileName(self, uri, size):
+    """Helper function to give the cache file for an image size"""
+    name = hashlib.md5(uri.encode('utf-8')).hexdigest()
+    if (size):
+      name += '-' + str(size)
+    return os.path.join(self.directory, name)
+
+  def Get(self, uri, size=None):
+    """Return the CachedImage for uri at a thumbnail size, or the full size
+       image if size is None.  Returns None if the image can't be fetched
+       or size isn't one of thumbnailSizes"""
+    if (not self.IsSizeValid(size)):
+      return None
+    if (Image is None):
+      size = None
+    return self.memory.GetOrCreate((uri, size),
+                                   lambda: self.__ReadDisk(uri, size) or
+                                           self.__FetchOnce(uri, size))
+
+  def __FetchOnce(self, uri, size):
+    """Helper function to fetch an image unless it is already being or has
+       just been fetched.  Returns the image at size"""
+    images = self.recentFetches.GetOrCreate(uri, lambda: self.__Fetch(uri))
+    if (images is None):
+      return None
+    return images[size]
+
+  def __ReadDisk(self, uri, size):
+    """Helper function to read an image from disk, marking it as recently
+       used"""
+    fileName = self.__FileName(uri, size)
+    try:
+      with open(fileName, 'rb') as f:
+        data = f.read()
+      os.utime(fileName, None)
+    except (IOError, OSError):
+      return None
+    self.diskHits += 1
+    return CachedImage(data, ImageCache.__ContentType(data))
+
+  def __Fetch(self, uri):
+    """Helper function to fetch an image and make its thumbnails, all of
+       which are written to disk.  Returns a dict of the images by size"""
+    try:
+      data = self.loader(uri)
+    except Exception as e:
+      Debug("Image fetch failed:", uri, e)
+      data = None
+    if (not data):
+      return None
+    self.fetches += 1
+    images = { None: CachedImage(data, ImageCache.__ContentType(data)) }
+    if (Image):
+      for s in self.thumbnailSizes:
+        images[s] = self.__MakeThumbnail(data, s) or images[None]
+    for (s, image) in images.items():
+      self.__WriteDisk(uri, s, image.data)
+    return images
+
+  @staticmethod
+  def __MakeThumbnail(data, size):
+    """Helper function to scale an image so its longest side is size"""
+    try:
+      image = Image.open(io.BytesIO(data))
+      image.thumbnail((size, size), Image.ANTIALIAS)
+      out = io.BytesIO()
+      image.convert('RGB').save(out, 'JPEG', quality=85)
+      return CachedImage(out.getvalue(), 'image/jpeg')
+    except Exception as e:
+      Debug("Thumbnail failed:", e)
+      return None
+
+  def __WriteDisk(self, uri, size, data):
+    """Helper function to write an image to disk.  Writes go via a
+       temporary file so that readers never see a partial image"""
+    fileName = self.__FileName(uri, size)
+    temp = fileName + '.' + str(threading.current_thread().ident)
+    try:
+      with open(temp, 'wb') as f:
+        f.write(data)
+      existed = os.path.exists(fileName)
+      os.rename(temp, fileName)
+    except (IOError, OSError) as e:
+      Debug("Image write failed:", e)
+      return
+    if (not existed):
+      with self.lock:
+        self.diskCount += 1
+        evict = self.diskCount > self.diskSize
+      if (evict):
+        self.__EvictDisk()
+
+  def __EvictDisk(self):
+    """Helper function to remove the least recently used images on disk
+       down to 90% of diskSize, so that eviction isn't needed on every
+       write"""
+    with self.lock:
+      files = []
+      for name in os.listdir(self.directory):
+        path = os.path.join(self.directory, name)
+        try:
+          files.append((os.path.getmtime(path), path))
+        except OSError:
+          pass
+      files.sort()
+      excess = len(files) - (self.diskSize * 9) // 10
+      for (mtime, path) in files[0:max(0, excess)]:
+        try:
+          os.remove(path)
+        except OSError:
+          pass
+      self.diskCount = len(files) - max(0, excess)
+
+  def GetStats(self):
+    """Memory cache statistics together with the number of disk hits,
+       fetches and images on disk"""
+    stats = self.memory.GetStats()
+    stats['diskHits'] = self.diskHits
+    stats['fetches'] = self.fetches
+    stats['diskSize'] = self.diskCount
+    return stats
@@ -0,0 +1,122 @@
+"""
+LruCache
+
+A bounded, thread-safe least recently used cache with optional expiry.
+
+Copyright (c) 2014 All Right Reserved, Liam Wickins
+
+Please see the LICENSE file for more information.
+
+THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+PARTICULAR PURPOSE.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+class LruCache():
+  """Holds upto size entries, evicting the least recently used entry when
+     full.  Entries older than ttl seconds (if given) are treated as
+     missing, as are entries for which the optional valid(value) function
+     returns False.  Hits, misses and evictions are counted.
+  """
+
+  def __init__(self, size, ttl=None, valid=None):
+    self.size = size
+    self.ttl = ttl
+    self.valid = valid
+    self.entries = OrderedDict()      # key -> (time added, value)
+    self.lock = threading.Lock()
+    self.creating = {}                # key -> creation in progress
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __Lookup(self, key):
+    """Helper function to find a live entry, must be called with the lock
+       held.  Returns (True, value) on a hit or (False, None) on a miss"""
+    entry = self.entries.pop(key, None)
+    if (entry):
+      (added, value) = entry
+      if ((self.ttl is None or time.time() - added < self.ttl) and
+          (self.valid is None or self.valid(value))):
+        self.entries[key] = entry     # Most recently used goes to the end
+        self.hits += 1
+        return (True, value)
+    self.misses += 1
+    return (False, None)
+
+  def __Store(self, key, value):
+    """Helper function to add an entry, must be called with the lock held"""
+    self.entries.pop(key, None)
+    self.entries[key] = (time.time(), value)
+    while (len(self.entries) > self.size):
+      self.entries.popitem(last=False)
+      self.evictions += 1
+
+  def Get(self, key, default=None):
+    """Return the value for key or default if not cached"""
+    with self.lock:
+      (found, value) = self.__Lookup(key)
+    if (found):
+      return value
+    return default
+
+  def Put(self, key, value):
+    """Add or replace the value for key"""
+    with self.lock:
+      self.__Store(key, value)
+
+  def GetOrCreate(self, key, create):
+    """Return the value for key, or if not cached store and return the
+       value of create().  Concurrent callers for the same key wait for a
+       single create() and share its value.  create() is called without
+       the cache locked so other keys aren't held up by it, and it may use
+       the cache itself"""
+    while (True):
+      with self.lock:
+        (found, value) = self.__Lookup(key)
+        if (found):
+          return value
+        creation = self.creating.get(key)
+        if (creation is None):
+          creation = { 'done': threading.Event(), 'created': False,
+                       'value': None }
+          self.creating[key] = creation
+          break
+      # Wait for the other caller's value, or try again if it failed
+      creation['done'].wait()
+      if (creation['created']):
+        return creation['value']
+    try:
+      value = create()
+    except:
+      with self.lock:
+        del self.creating[key]
+      creation['done'].set()
+      raise
+    with self.lock:
+      self.__Store(key, value)
+      del self.creating[key]
+    creation['value'] = value
+    creation['created'] = True
+    creation['done'].set()
+    return value
+
+  def Remove(self, key):
+    with self.lock:
+      self.entries.pop(key, None)
+
+  def Clear(self):
+    with self.lock:
+      self.entries.clear()
+
+  def GetStats(self):
+    """Returns hit, miss and eviction counts and the current size"""
+    return { 'hits': self.hits,
+             'misses': self.misses,
+             'evictions': self.evictions,
+             'size': len(self.entries) }
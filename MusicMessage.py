@@ -22,6 +22,7 @@ class MusicStatus:
   STATUS_UNKNOWN_INFO_OBJECT_REQUESTED = 3
   STATUS_NOT_YET_IMPLEMENTED = 4
   STATUS_MISSING_PARAMETER = 5
+  STATUS_NOT_PLAYING = 6
 
 class MusicMessage:
 
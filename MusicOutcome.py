@@ -38,11 +38,13 @@ class MusicOutcome(WitAiOutcome):
     volume = "(volume)"
     shuffle = "(shuffle)"
     reset = "(reset)"
+    seek = "(seek)"
     sink = "(sink)"
     image = "(image)"
     info = "(info)"
     navi = "(skip|back)"
     obj = " (track|playlist|playlisthash)"
+    since = " (since)"
     cmd = "(back|skip|stop|pause|resume|play|reset|clear|preview|quit|exit|stats|info|mute|unmute|louder|quieter|volume|shuffle|sink|scan|disconnect)"
     x = " (.+)"
     num = " (\d+)"
@@ -93,9 +95,11 @@ class MusicOutcome(WitAiOutcome):
       ("^"+volume+num+"$", 'V_x', ['volume']),
       ("^set "+sink+num+"$", 'V_x', ['sink']),
       ("^"+sink+num+"$", 'V_x', ['sink']),
+      ("^"+info+obj+since+num+"$", 'V_x_N_x', ['object']),
       ("^"+info+obj+"$", 'V_x', ['object']),
       ("^"+navi+num+"$", 'V_x', ['number']),
       ("^"+reset+num+"$", 'V_x', ['position']),
+      ("^"+seek+num+"$", 'V_x', ['seconds']),
       ("^"+shuffle+onOff+"$", 'V_x', ['state']),
       ("^"+cmd+"$", 'V', [])
     ]
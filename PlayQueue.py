@@ -14,74 +14,386 @@ PARTICULAR PURPOSE.
 """
 
 from __future__ import print_function
-import spotify
+import array
+import os
+from collections import deque
 import hashlib
 import random
 import sys
 
+# Use the simulated Spotify backend for offline testing if requested
+if (os.environ.get('SPOTIFY_SIMULATOR')):
+  import FakeSpotify as spotify
+else:
+  import spotify
+
 def Debug(*objs):
   print("PlayQueue:", *objs, file=sys.stderr)
 
 class PlayQueue():
+  """Queue of track URIs and the order they are played in.
 
-  def __init__(self, session, callback=None):
-    self.queue = []
-    self.indexes = []
-    self.index = 0
+     The queue is held as two lists so that tracks can be inserted at the
+     front as well as appended at the end without moving the rest: 'front'
+     holds inserted tracks in reverse order and 'back' holds appended
+     tracks.  Each track has a fixed id, negative in the front list and
+     positive in the back list, which doesn't change as tracks are added
+     around it, so the shuffled play order can be kept as an array of ids.
+
+     Shuffling is lazy: the play order array starts in queue order and each
+     position is only drawn at random from the tracks not yet played when
+     it is reached, i.e., an incremental Fisher-Yates shuffle.  The drawn
+     part of the array is the history of what has been played.  Each id's
+     index in the play order is kept too, so finding a track in the play
+     order and inserting tracks into it take time in proportion to the
+     tracks involved rather than the size of the queue.
+
+     Every change to the tracks bumps a version number and extends a hash
+     of the changes made, so that clients can tell the queue has changed
+     without it being hashed in full.  The most recent changes are kept so
+     that clients can catch up from their last version with just the
+     changes made since.
+
+     If a QueueStore is given every change is recorded in it as it is made
+     and the queue is restored from it on startup.  Restoring only reads
+     back track URIs, nothing is resolved until it is played.
+  """
+
+  # Time in seconds to wait for a track's metadata before skipping it
+  LOAD_TIMEOUT = 2
+
+  # Number of failed tracks skipped over in one go before giving up
+  MAX_FAILED_TRACKS = 3
+
+  # Number of changes to the tracks kept for clients to catch up with
+  CHANGE_HISTORY = 100
+
+  def __init__(self, session, callback=None, gapless=True, store=None,
+               dispatch=None):
+    """When gapless is set the next track in the queue is resolved ahead of
+       time and played straight on from the end of the current track.
+       The end of each track is handled on the libspotify thread unless
+       dispatch(func) is given to run it elsewhere, e.g., on the thread
+       which makes all other changes to the queue"""
+    self.front = []
+    self.back = []
+    self.order = None                 # Play order of ids when shuffled
+    self.whereFront = None            # Play order index of front/back ids
+    self.whereBack = None
+    self.drawn = 0                    # Number of play order entries drawn
+    self.random = random.Random()
+    self.index = 0                    # Current position in play order
     self.shuffleOn = False
+    self.version = 0
+    self.playlistHash = hashlib.md5().hexdigest()
+    self.changes = deque(maxlen=self.CHANGE_HISTORY)
     self.session = session
-    self.session.NotifyCallback(self.__Callback)
+    self.session.NotifyCallback(self.__Notify)
     self.userCallback = callback
+    self.dispatch = dispatch
+    self.gapless = gapless
+    self.nextTrack = None
+    self.store = store
+    self.saved = 0                    # Number of play order entries stored
+    if (self.store):
+      self.__Restore()
+
+  def __Restore(self):
+    """Helper function to restore the queue from the store"""
+    (self.front, self.back) = self.store.GetTracks()
+    state = self.store.GetState()
+    self.version = state.get('version', 0)
+    self.playlistHash = str(state.get('hash', self.playlistHash))
+    self.index = state.get('index', 0)
+    if (self.index >= self.QueueSize()):
+      self.index = 0
+    if (state.get('shuffle')):
+      self.shuffleOn = True
+      self.order = self.store.GetPlayed()
+      played = set(self.order)
+      self.order.extend(i for i in xrange(-len(self.front), len(self.back))
+                        if i not in played)
+      self.drawn = self.saved = len(played)
+      self.__Reindex()
+      if (self.order):
+        self.__Draw(self.index)
+    Debug("PlayQueue restored", self)
+
+  def __Save(self):
+    """Helper function to store the current state along with any of the
+       play order drawn since it was last stored"""
+    if (not self.store):
+      return
+    played = None
+    if (self.order is not None):
+      played = self.order[self.saved:self.drawn]
+    self.store.Save({ 'index': self.index, 'shuffle': self.shuffleOn,
+                      'version': self.version, 'hash': self.playlistHash },
+                    self.saved, played)
+    self.saved = self.drawn
+
+  def __Unsaved(self, index):
+    """Helper function to mark the play order from index on as changed"""
+    self.saved = min(self.saved, index)
+
+  def __StoreTracks(self, first, uris):
+    """Helper function to store tracks with consecutive ids from first"""
+    if (self.store):
+      self.store.AddTracks(zip(xrange(first, first + len(uris)), uris))
+
+  def __Changed(self, op, uris):
+    """Helper function to record a change to the tracks in the queue"""
+    self.version += 1
+    md5 = hashlib.md5(self.playlistHash)
+    md5.update(op)
+    for uri in uris:
+      md5.update(uri)
+    self.playlistHash = md5.hexdigest()
+    self.changes.append((self.version, op, uris))
+
+  def __Id(self, pos):
+    """Helper function to convert a queue position to a track id"""
+    return pos - len(self.front)
+
+  def __Pos(self, index):
+    """Helper function to convert a play order index to a queue position"""
+    if (self.order is None):
+      return index
+    return self.order[index] + len(self.front)
 
   def __FindPos(self, pos):
-    return self.indexes.index(pos)
+    """Helper function to convert a queue position to a play order index.
+       A track which hasn't been played yet is drawn to play next"""
+    if (self.order is None):
+      return pos
+    index = self.__Index(self.__Id(pos))
+    if (index >= self.drawn):
+      self.__Swap(index, self.drawn)
+      index = self.drawn
+      self.drawn += 1
+    return index
+
+  def GetTrack(self, pos):
+    """Track URI at a queue position"""
+    n = len(self.front)
+    if (pos < n):
+      return self.front[n - 1 - pos]
+    return self.back[pos - n]
 
   def QueueIndex(self):
     if (self.QueueSize() > 0):
-      return self.indexes[self.index]
+      return self.__Pos(self.index)
     return None
 
-  def __Shuffle(self, items):
-    if (self.shuffleOn):
-      random.shuffle(items)
-    return items
+  def __Index(self, i):
+    """Helper function to find the play order index of a track id"""
+    if (i >= 0):
+      return self.whereBack[i]
+    return self.whereFront[-1 - i]
+
+  def __SetIndex(self, i, index):
+    if (i >= 0):
+      self.whereBack[i] = index
+    else:
+      self.whereFront[-1 - i] = index
+
+  def __Reindex(self):
+    """Helper function to rebuild the play order index of every id"""
+    self.whereFront = array.array('l', [0]) * len(self.front)
+    self.whereBack = array.array('l', [0]) * len(self.back)
+    for (index, i) in enumerate(self.order):
+      self.__SetIndex(i, index)
+
+  def __Swap(self, i, j):
+    order = self.order
+    (order[i], order[j]) = (order[j], order[i])
+    self.__SetIndex(order[i], i)
+    self.__SetIndex(order[j], j)
+
+  def __Draw(self, index):
+    """Helper function to draw the play order upto index at random from the
+       tracks not yet drawn"""
+    if (not self.order):
+      return
+    last = len(self.order) - 1
+    index = min(index, last)
+    while (self.drawn <= index):
+      self.__Swap(self.drawn, self.random.randint(self.drawn, last))
+      self.drawn += 1
+
+  def __Unshuffled(self):
+    """Helper function to start a play order of ids in queue order"""
+    n = len(self.front)
+    self.order = array.array('l', xrange(-n, len(self.back)))
+    self.whereFront = array.array('l', xrange(n - 1, -1, -1))
+    self.whereBack = array.array('l', xrange(n, n + len(self.back)))
+
+  def Reseed(self, seed=None):
+    """Reseed the shuffle, the tracks not yet played are drawn afresh"""
+    self.random.seed(seed)
+    self.drawn = min(self.drawn, self.index + 1)
+    self.__Unsaved(self.drawn)
+    self.__Save()
  
+  def __Notify(self):
+    if (self.dispatch):
+      self.dispatch(self.__Callback)
+    else:
+      self.__Callback()
+
   def __Callback(self):
-    Debug("PlayQueue callback called", self);
-    self.SkipForward()
+    Debug("PlayQueue callback called");
+    if (not self.__ContinueGapless()):
+      self.SkipForward()
     if (self.userCallback):
       self.userCallback()
 
+  def __NextIndex(self):
+    index = self.index + 1
+    if (index >= self.QueueSize()):
+      index = 0
+    self.__Draw(index)
+    return index
+
+  def __Preload(self):
+    """Resolve the next track in the queue ahead of time and ask the session
+       to prefetch it so that it can follow on without a gap"""
+    self.nextTrack = None
+    if (self.gapless and self.QueueSize() > 0):
+      index = self.__NextIndex()
+      uri = self.GetTrack(self.__Pos(index))
+      track = spotify.Track(uri)
+      if (track.is_loaded):
+        self.session.PrefetchTrack(track)
+      self.nextTrack = (index, uri, track)
+
+  def __ContinueGapless(self):
+    """Continue with the preloaded track at the end of the current track.
+       Returns False if the preloaded track can't be used"""
+    if (not self.gapless or not self.nextTrack):
+      return False
+    (index, uri, track) = self.nextTrack
+    self.nextTrack = None
+    # The queue may have changed since the track was preloaded
+    if (index >= self.QueueSize()):
+      return False
+    self.__Draw(index)
+    if (self.GetTrack(self.__Pos(index)) != uri):
+      return False
+    if (not track.is_loaded):
+      return False
+    Debug("PlayQueue continuing gapless");
+    self.index = index
+    self.session.ContinueWithTrack(track)
+    self.__Preload()
+    self.__Save()
+    return True
+
   def Insert(self, results):
-    self.indexes = [i+len(results) for i in self.indexes]
-    self.indexes = self.__Shuffle(range(0, len(results))) + self.indexes
-    self.queue = results + self.queue
-    self.index += (len(results) % self.QueueSize())
+    """Insert tracks at the front of the queue, keeping the current track.
+       When shuffled the inserted tracks are played next in random order"""
+    if (not results):
+      return
+    wasEmpty = (self.QueueSize() == 0)
+    self.front.extend(reversed(results))
+    if (self.order is None):
+      if (not wasEmpty):
+        self.index += len(results)
+    else:
+      ids = array.array('l', xrange(-len(self.front),
+                                    -len(self.front) + len(results)))
+      self.random.shuffle(ids)
+      first = len(self.order)
+      self.order.extend(ids)
+      self.whereFront.extend(array.array('l', [0]) * len(ids))
+      for (index, i) in enumerate(ids, first):
+        self.__SetIndex(i, index)
+      if (wasEmpty):
+        self.drawn = 1
+      else:
+        # The inserted tracks are swapped in to play next and everything
+        # after them is drawn again
+        for n in xrange(len(ids)):
+          self.__Swap(self.index + 1 + n, first + n)
+        self.drawn = self.index + 1 + len(ids)
+        self.__Unsaved(self.index + 1)
+    self.__Changed('insert', results)
+    self.__StoreTracks(-len(self.front), results)
+    self.__Save()
 
   def Append(self, results):
-    end = self.QueueSize()
-    self.queue += results
-    self.indexes += self.__Shuffle(range(end, end+self.QueueSize()))
+    """Append tracks at the end of the queue"""
+    if (not results):
+      return
+    end = len(self.back)
+    self.back.extend(results)
+    if (self.order is not None):
+      first = len(self.order)
+      self.order.extend(xrange(end, end + len(results)))
+      self.whereBack.extend(xrange(first, first + len(results)))
+      if (end == 0 and not self.front):
+        self.__Draw(0)
+    self.__Changed('append', results)
+    self.__StoreTracks(end, results)
+    self.__Save()
 
   def QueueSize(self):
-    return len(self.queue)
+    return len(self.front) + len(self.back)
 
   def GetCurrentTrack(self):
     if (self.index < self.QueueSize()):
-      return self.queue[self.QueueIndex()]
+      return self.GetTrack(self.QueueIndex())
 
   def GetAllTracks(self):
-    return self.queue
+    return self.front[::-1] + self.back
+
+  def GetVersion(self):
+    """Number of changes made to the tracks in the queue"""
+    return self.version
 
   def GetPlaylistHash(self):
-    md5 = hashlib.md5()
-    for i in self.queue: md5.update(i)
-    return md5.hexdigest()
+    """Hash which changes whenever the tracks in the queue change"""
+    return self.playlistHash
+
+  def GetChanges(self, version):
+    """Changes made to the tracks since version as a list of (version, op,
+       uris), where op is 'insert', 'append' or 'clear'.  Returns None if
+       the changes aren't known or would be more than the whole queue, in
+       which case the client should fetch all the tracks again"""
+    return PlayQueue.FindChanges(self.GetChangeHistory(), version,
+                                 self.version, self.QueueSize())
+
+  def GetChangeHistory(self):
+    """Copy of the most recent changes, see FindChanges()"""
+    return list(self.changes)
+
+  @staticmethod
+  def FindChanges(history, version, current, size):
+    """Changes since version from a copy of the change history taken at
+       version current, when the queue held size tracks.  See GetChanges()"""
+    if (version == current):
+      return []
+    if (version > current or not history or history[0][0] > version + 1):
+      return None
+    changes = [c for c in history if c[0] > version]
+    if (sum(len(uris) for (v, op, uris) in changes) > size):
+      return None
+    return changes
 
   def Clear(self):
-    self.queue = []
-    self.indexes = []
+    self.front = []
+    self.back = []
+    if (self.order is not None):
+      self.order = array.array('l')
+      self.whereFront = array.array('l')
+      self.whereBack = array.array('l')
+      self.drawn = 0
     self.index = 0
+    self.__Changed('clear', [])
+    if (self.store):
+      self.store.Clear()
+    self.saved = 0
+    self.__Save()
     self.Stop()
 
   def ResetPos(self, pos=0):
@@ -99,25 +411,51 @@ class PlayQueue():
   def Resume(self):
     self.session.Resume()
 
+  def Seek(self, ms):
+    """Seek to ms into the current track"""
+    Debug("PlayQueue seek", ms);
+    return self.session.Seek(ms)
+
   def GetShuffleState(self):
     if (self.shuffleOn):
       return 'on'
     return 'off'
 
   def Shuffle(self, state):
+    """Turn shuffle 'on' or 'off', the current track stays current.  Turning
+       shuffle on when it is already on reshuffles the tracks not yet
+       played.  Nothing is shuffled up front so this is quick for any size
+       of queue"""
+    pos = self.QueueIndex()
     if (state == 'on'):
+      if (self.shuffleOn):
+        self.Reseed()
+        return
       self.shuffleOn = True
+      self.__Unshuffled()
+      self.drawn = 0
+      self.index = 0
+      if (pos is not None):
+        # The current track goes first followed by the rest shuffled
+        self.__Swap(0, pos)
+        self.drawn = 1
     else:
       self.shuffleOn = False
-      self.index = self.QueueIndex()
-    if (self.QueueSize() > 0):
-      self.indexes = self.__Shuffle(range(0,self.index)) + [self.index] + \
-                     self.__Shuffle(range(self.index+1,self.QueueSize()))
+      self.order = None
+      self.whereFront = None
+      self.whereBack = None
+      self.drawn = 0
+      if (pos is not None):
+        self.index = pos
+    self.saved = 0
+    self.__Save()
 
   def SkipBack(self, number=1):
+    """Skip back, when shuffled this goes back through the tracks played
+       and stops at the first"""
     self.index -= number
     if (self.index < 0):
-      if (self.QueueSize() > 0):
+      if (self.QueueSize() > 0 and self.order is None):
         self.index = self.QueueSize()-1
       else:
         self.index = 0
@@ -127,15 +465,36 @@ class PlayQueue():
     self.index += number
     if (self.index >= self.QueueSize()):
       self.index = 0
+    self.__Draw(self.index)
     self.Play()
 
+  def __PlayTrack(self, uri):
+    """Helper function to load and play a track, returns False if the track
+       didn't load or its audio stalled"""
+    Debug("PlayQueue loading track");
+    try:
+      t = spotify.Track(uri).load(self.LOAD_TIMEOUT)
+    except spotify.Error:
+      Debug("PlayQueue track load failed", uri);
+      return False
+    return self.session.PlayTrack(t)
+
   def Play(self):
+    """Play the current track.  A track which fails is skipped over to the
+       next entry in the queue straight away, upto MAX_FAILED_TRACKS in a
+       row.  Returns False if nothing could be played"""
     Debug("PlayQueue play");
+    for i in range(min(self.QueueSize(), self.MAX_FAILED_TRACKS)):
+      if (self.__PlayTrack(self.GetCurrentTrack())):
+        self.__Preload()
+        self.__Save()
+        return True
+      Debug("PlayQueue skipping failed track");
+      self.index = self.__NextIndex()
+    self.__Save()
     self.Stop()
-    if (self.QueueSize() > 0):
-      Debug("PlayQueue loading track");
-      t = spotify.Track(self.queue[self.QueueIndex()]).load()
-      self.session.PlayTrack(t)
+    return False
 
   def __repr__(self):
-    return repr(self.__dict__)
+    return repr({ 'size': self.QueueSize(), 'index': self.index,
+                  'shuffle': self.shuffleOn, 'version': self.version })
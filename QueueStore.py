@@ -0,0 +1,103 @@
+"""
+QueueStore
+
+Persistent store for the play queue using SQLite.
+
+Copyright (c) 2014 All Right Reserved, Liam Wickins
+
+Please see the LICENSE file for more information.
+
+THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+PARTICULAR PURPOSE.
+"""
+
+import array
+import json
+import sqlite3 as sql
+import threading
+
+class QueueStore():
+  """Records changes to a play queue as they happen so that the queue can
+     be restored after a restart.
+
+     Tracks are stored by their play queue id (see PlayQueue) along with
+     their URI, so restoring needs no tracks resolving.  Only the drawn part
+     of a shuffled play order is stored since the rest is drawn at random
+     anyway.  Other state (the current position, shuffle state and version)
+     is stored as JSON values.
+
+     The store is used from the HTTP server and libspotify threads, so the
+     connection is shared under a lock.
+  """
+
+  def __init__(self, dbName):
+    self.conn = sql.connect(dbName, check_same_thread=False)
+    self.lock = threading.Lock()
+    cmds = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY, uri TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS played (position INTEGER PRIMARY KEY, id INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)",
+    ]
+    with self.lock:
+      for cmd in cmds:
+        self.conn.execute(cmd)
+      self.conn.commit()
+
+  def AddTracks(self, tracks):
+    """Add a list of (id, uri) tracks"""
+    with self.lock:
+      self.conn.executemany("INSERT OR REPLACE INTO queue VALUES (?, ?)",
+                            tracks)
+      self.conn.commit()
+
+  def Clear(self):
+    """Remove all tracks and the play order"""
+    with self.lock:
+      self.conn.execute("DELETE FROM queue")
+      self.conn.execute("DELETE FROM played")
+      self.conn.commit()
+
+  def Save(self, state, start=0, played=None):
+    """Save a dict of state.  The play order from position start onwards
+       is replaced by the list of ids played, or removed if None"""
+    with self.lock:
+      self.conn.executemany("INSERT OR REPLACE INTO state VALUES (?, ?)",
+                            [(k, json.dumps(v)) for (k, v) in state.items()])
+      self.conn.execute("DELETE FROM played WHERE position >= ?", (start,))
+      if (played):
+        self.conn.executemany("INSERT INTO played VALUES (?, ?)",
+                              enumerate(played, start))
+      self.conn.commit()
+
+  def GetTracks(self):
+    """Returns the lists of track URIs (front, back) by id: the front list
+       holds ids -1, -2, ... and the back list ids 0, 1, ..."""
+    with self.lock:
+      rows = self.conn.execute("SELECT id, uri FROM queue WHERE id < 0 "
+                               "ORDER BY id DESC").fetchall()
+      front = [str(uri) for (i, uri) in rows]
+      rows = self.conn.execute("SELECT id, uri FROM queue WHERE id >= 0 "
+                               "ORDER BY id").fetchall()
+      back = [str(uri) for (i, uri) in rows]
+    return (front, back)
+
+  def GetState(self):
+    """Returns the dict of state saved"""
+    with self.lock:
+      rows = self.conn.execute("SELECT key, value FROM state").fetchall()
+    return dict((str(k), json.loads(v)) for (k, v) in rows)
+
+  def GetPlayed(self):
+    """Returns the play order saved as an array of ids"""
+    with self.lock:
+      rows = self.conn.execute("SELECT id FROM played "
+                               "ORDER BY position").fetchall()
+    return array.array('l', (i for (i,) in rows))
+
+  def Exit(self):
+    with self.lock:
+      self.conn.close()
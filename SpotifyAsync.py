@@ -0,0 +1,190 @@
+"""
+SpotifyAsync
+
+An asyncio front-end to SpotifyService.  Login, search, track loading and
+playback state are exposed as awaitable futures which are completed from
+the libspotify callbacks, so that a single event loop can serve many
+concurrent clients without a thread blocked per request.
+
+Copyright (c) 2014 All Right Reserved, Liam Wickins
+
+Please see the LICENSE file for more information.
+
+THIS CODE AND INFORMATION ARE PROVIDED "AS IS" WITHOUT WARRANTY OF ANY
+KIND, EITHER EXPRESSED OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND/OR FITNESS FOR A
+PARTICULAR PURPOSE.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Python 2 has no asyncio, the trollius backport provides the same API
+try:
+  import asyncio
+except ImportError:
+  import trollius as asyncio
+
+# Use the simulated Spotify backend for offline testing if requested
+if (os.environ.get('SPOTIFY_SIMULATOR')):
+  import FakeSpotify as spotify
+else:
+  import spotify
+
+class SpotifyAsync():
+  """Wraps a SpotifyService so that its blocking Wait...() calls are
+     replaced by futures on an event loop.
+
+     Every method returns a future (await it under Python 3, or use
+     'yield From(...)' with trollius) and must be called from the event
+     loop's thread.  libspotify callbacks are passed onto the loop with
+     call_soon_threadsafe(), so futures are only ever completed on the
+     loop.  Callers wanting a timeout should use asyncio.wait_for().
+
+     Playback commands which change the player (PlayTrack(), Stop()) are
+     run one at a time on a single worker thread since they drive the audio
+     sink as well as libspotify.
+  """
+
+  # Session events which may be waited on with NextEvent()
+  EVENTS = [ spotify.SessionEvent.LOGGED_IN,
+             spotify.SessionEvent.LOGGED_OUT,
+             spotify.SessionEvent.CONNECTION_ERROR,
+             spotify.SessionEvent.START_PLAYBACK,
+             spotify.SessionEvent.STOP_PLAYBACK,
+             spotify.SessionEvent.END_OF_TRACK,
+             spotify.SessionEvent.STREAMING_ERROR,
+             spotify.SessionEvent.METADATA_UPDATED ]
+
+  def __init__(self, service, loop=None):
+    self.service = service
+    self.loop = loop or asyncio.get_event_loop()
+    self.waiters = {}                 # event -> futures awaiting it
+    self.loading = []                 # (track, future) awaiting metadata
+    self.commands = ThreadPoolExecutor(max_workers=1)
+
+    for e in self.EVENTS:
+      self.waiters[e] = []
+      self.service.AddEventListener(e, self.__Listener(e))
+
+  def __Listener(self, event):
+    """Helper function to make a libspotify listener for an event which
+       hands the event's parameter (if any) onto the loop"""
+    def Listener(*args):
+      param = args[0] if args else None
+      self.loop.call_soon_threadsafe(self.__Dispatch, event, param)
+    return Listener
+
+  def __Dispatch(self, event, param):
+    """Complete every future waiting for an event, runs on the loop"""
+    waiters = self.waiters[event]
+    self.waiters[event] = []
+    for future in waiters:
+      if (not future.done()):
+        future.set_result(param)
+    if (event == spotify.SessionEvent.METADATA_UPDATED):
+      self.__CheckLoading()
+
+  def __CheckLoading(self):
+    """Complete the futures of any tracks which have finished loading"""
+    loading = []
+    for (track, future) in self.loading:
+      if (future.done()):
+        continue
+      if (track.is_loaded):
+        future.set_result(track)
+      else:
+        loading.append((track, future))
+    self.loading = loading
+
+  def __NewFuture(self):
+    return asyncio.Future(loop=self.loop)
+
+  def __Resolve(self, future, result):
+    """Helper function to complete a future from any thread"""
+    def Set():
+      if (not future.done()):
+        future.set_result(result)
+    self.loop.call_soon_threadsafe(Set)
+
+  def NextEvent(self, event):
+    """Future for the parameter of the next occurrence of a session event
+       (one of EVENTS), or None for events without a parameter"""
+    future = self.__NewFuture()
+    self.waiters[event].append(future)
+    return future
+
+  def Login(self, userName, password):
+    """Future for the login result, an error type which is OK on success"""
+    future = self.NextEvent(spotify.SessionEvent.LOGGED_IN)
+    self.service.LoginUser(userName, password, wait=False)
+    return future
+
+  def Logout(self):
+    """Future which completes once logged out"""
+    future = self.NextEvent(spotify.SessionEvent.LOGGED_OUT)
+    self.service.LogoutUser(wait=False)
+    return future
+
+  def __SearchFuture(self, handle):
+    """Helper function to make a future for a search handle"""
+    future = self.__NewFuture()
+    handle.AddCallback(lambda search: self.__Resolve(future, search))
+    return future
+
+  def SearchNew(self, query, **kwargs):
+    """Future for a new search, which takes the same arguments as
+       SpotifyService.SearchNew() (except wait and timeout) and is cached
+       in the same way"""
+    return self.__SearchFuture(self.service.SearchNew(query, wait=False,
+                                                      **kwargs))
+
+  def SearchMore(self, search):
+    """Future for more results following on from a completed search"""
+    return self.__SearchFuture(self.service.SearchMore(search, wait=False))
+
+  def LoadTrack(self, uri):
+    """Future for a track once its metadata has loaded"""
+    future = self.__NewFuture()
+    track = spotify.Track(uri)
+    if (track.is_loaded):
+      future.set_result(track)
+    else:
+      self.loading.append((track, future))
+      # Metadata may have arrived before the track was added to the list
+      self.loop.call_soon(self.__CheckLoading)
+    return future
+
+  def ExpandTracks(self, uris, timeout=5):
+    """Future for compact track records, see SpotifyService.ExpandTracks()"""
+    return self.loop.run_in_executor(None, self.service.ExpandTracks, uris,
+                                     timeout)
+
+  def __Command(self, func, *args):
+    """Helper function to run a playback command in the executor, commands
+       have a single worker so that they are applied in order"""
+    return self.loop.run_in_executor(self.commands, func, *args)
+
+  def PlayTrack(self, track):
+    """Future which completes once a track's audio has started"""
+    return self.__Command(self.service.PlayTrack, track)
+
+  def Stop(self):
+    """Future which completes once playback has stopped"""
+    return self.__Command(self.service.Stop)
+
+  def WaitForEndOfTrack(self):
+    """Future which completes at the end of the current track"""
+    return self.NextEvent(spotify.SessionEvent.END_OF_TRACK)
+
+  def WaitForPlay(self):
+    """Future which completes when libspotify starts playback"""
+    return self.NextEvent(spotify.SessionEvent.START_PLAYBACK)
+
+  def WaitForStop(self):
+    """Future which completes when libspotify stops playback"""
+    return self.NextEvent(spotify.SessionEvent.STOP_PLAYBACK)
+
+  def GetPlayState(self):
+    """Current play state, this doesn't block so needs no future"""
+    return self.service.GetPlayState()
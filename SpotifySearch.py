@@ -48,7 +48,7 @@ class SpotifySearch():
       resp = self.musicDb.GetResults()
       results += [t['uri'] for t in resp]
     if (not self.offline):
-      resp = self.session.WaitForSearch(timeout)
+      resp = self.session.WaitForSearch(self.search, timeout)
       if (resp):
         info = self.session.GetSearchInfo(resp)
         results += [t.link.uri for t in info['tracks']]
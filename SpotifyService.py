@@ -18,26 +18,141 @@ PARTICULAR PURPOSE.
 """
 
 from __future__ import print_function
+import os
 import sys
-import spotify
 import threading
+import time
 from collections import deque
 from AudioBuffer import AudioBuffer
-from AudioStream import AudioStream
+from LruCache import LruCache
+
+# Use the simulated Spotify backend for offline testing if requested
+if (os.environ.get('SPOTIFY_SIMULATOR')):
+  import FakeSpotify as spotify
+else:
+  import spotify
 
 def Debug(*objs):
   print("SpotifyService:", *objs, file=sys.stderr)
 
+class SpotifyServiceExceptionUnknownSink:
+  """Exception raised when an audio sink is requested which is not known"""
+  pass
+
+class SpotifyServiceExceptionTooManySearches:
+  """Exception raised when too many searches are already in progress"""
+  pass
+
+class SearchHandle():
+  """Handle for a single search in progress.  Each search is completed by
+     its own callback so that concurrent searches can't receive each
+     other's results.
+  """
+
+  def __init__(self, done=None):
+    self.event = threading.Event()
+    self.lock = threading.Lock()
+    self.search = None
+    self.done = done
+    self.callbacks = []
+    self.started = time.time()
+
+  def Complete(self, search):
+    """Search completion callback"""
+    self.search = search
+    with self.lock:
+      self.event.set()
+      callbacks = self.callbacks
+      self.callbacks = []
+    if (self.done):
+      self.done(self)
+    for callback in callbacks:
+      callback(search)
+
+  def AddCallback(self, callback):
+    """Call callback(search) on completion, or straight away if the search
+       has already completed.  The callback may run on the libspotify
+       thread so it must not block"""
+    with self.lock:
+      if (not self.event.is_set()):
+        self.callbacks.append(callback)
+        return
+    callback(self.search)
+
+  def IsComplete(self):
+    return self.event.is_set()
+
+  def Wait(self, timeout):
+    """Wait for timeout for completion, returns the search or None"""
+    if (self.event.wait(timeout)):
+      return self.search
+    return None
+
 class SpotifyService():
   """
   Provides an interface allowing music tracks to be searched and an audio
   stream to be established with the Spotify music server.
   """
 
+  # Audio buffer occupancy at which music deliveries are refused
+  HIGH_WATERMARK_PERCENT = 90
+
+  # Longest time in seconds between processing libspotify events
+  MAX_EVENT_INTERVAL = 10
+
+  # Limit on searches in progress at any one time
+  MAX_PENDING_SEARCHES = 32
+
+  # Age in seconds after which a cached search still in progress is retried
+  SEARCH_STALL_TIMEOUT = 10
+
+  # Time in seconds without any audio arriving after which a track switch
+  # is treated as stalled, and the interval at which this is checked
+  STALL_TIMEOUT = 1.0
+  STALL_POLL_INTERVAL = 0.05
+
+  # Number of recent track switches kept for latency percentiles
+  SWITCH_HISTORY = 100
+
+  # Audio sinks which may be selected
+  SINKS = [ 'portaudio', 'null', 'file' ]
+
   def __init__(self,
                agentName="Python SpotifyClient",
-               logFile=b'/tmp/libspotify-trace.log'):
-    """Create spotify session and configure it"""
+               logFile=b'/tmp/libspotify-trace.log',
+               prebufferMs=500,
+               leadingSilenceMs=0,
+               softwareVolume=False,
+               outputRate=None,
+               sink='portaudio',
+               sinkArgs=None,
+               searchCacheSize=256,
+               searchCacheTtl=300,
+               trackCacheSize=4096):
+    """Create spotify session and configure it.
+
+       The audio stream for a new track is only started once prebufferMs
+       of audio has been delivered, and leadingSilenceMs of silence is
+       played ahead of the track.
+
+       If softwareVolume is set then volume and mute are applied to the
+       audio in-process (requires NumPy) rather than by the sound server.
+
+       If outputRate is set then all audio is converted to that rate in
+       stereo (requires NumPy) so that the output device is never reopened
+       for a different audio format.
+
+       The audio sink is one of 'portaudio' (the sound device), 'null' or
+       'file' and sinkArgs is a dict of keyword arguments for the sink,
+       e.g., {'speed': 4.0} or {'fileName': '/tmp/out.wav'}.
+
+       Upto searchCacheSize new searches are cached for searchCacheTtl
+       seconds so that repeated queries don't go back to the server.
+
+       Upto trackCacheSize expanded track records are cached by URI.
+    """
+    if (sink not in self.SINKS):
+      raise SpotifyServiceExceptionUnknownSink
     self.config = spotify.Config()
     self.config.user_agent = agentName
     self.config.tracefile = logFile
@@ -46,11 +161,43 @@ class SpotifyService():
     self.threadingEvent = {}
     self.audioFormat = {}
     self.notifyCallback = None
+    self.searchLock = threading.Lock()
+    self.deliveryLock = threading.Lock()
+    self.discarding = False           # Deliveries dropped while True
+    self.pendingSearches = set()      # Handles of searches in progress
+    self.searchCache = LruCache(searchCacheSize, ttl=searchCacheTtl,
+                                valid=self.__IsSearchUsable)
+    self.trackCache = LruCache(trackCacheSize)
  
-    # Create audio buffer
+    # Create audio buffer, libspotify is told to back off deliveries once
+    # the high watermark is reached rather than samples being dropped
     self.audioBuffer = AudioBuffer()
+    self.audioBuffer.SetWatermarks(high=(self.audioBuffer.GetBufSize() *
+                                         self.HIGH_WATERMARK_PERCENT) / 100)
     self.stream = None
-    self.volume = 0
+    if (softwareVolume):
+      from AudioVolume import AudioVolume
+      self.volume = AudioVolume()
+    else:
+      self.volume = None
+    if (outputRate):
+      from AudioConverter import AudioConverter
+      self.converter = AudioConverter(rate=outputRate)
+    else:
+      self.converter = None
+    self.sink = sink
+    self.sinkArgs = sinkArgs or {}
+    self.prebufferMs = prebufferMs
+    self.leadingSilenceMs = leadingSilenceMs
+    self.timeToFirstAudio = None
+    self.endOfTrack = None
+    self.interTrackGap = None
+    self.trackStart = 0               # Buffer read position of track start
+    self.trackBoundaries = deque()    # Buffer positions of next tracks
+    self.switchState = 'idle'
+    self.switchCount = 0
+    self.switchFailures = 0
+    self.switchLatencies = deque(maxlen=self.SWITCH_HISTORY)
 
     # Register for asynchronous callback events
     sessionEvent = 'spotify.SessionEvent.'
@@ -66,7 +213,7 @@ class SpotifyService():
                        spotify.SessionEvent.STOP_PLAYBACK: self.__EventListenerStopPlayback,
                        spotify.SessionEvent.END_OF_TRACK: self.__EventListenerEndOfTrack,
                        spotify.SessionEvent.GET_AUDIO_BUFFER_STATS: self.__EventListenerStats,
-                       'spotify.Search': self.__EventSearchComplete
+                       spotify.SessionEvent.METADATA_UPDATED: self.__EventListenerNull
                      }
 
     for e in self.eventsMap.keys():
@@ -75,24 +222,56 @@ class SpotifyService():
       if (not e.startswith('spotify')):
         self.session.on(e, self.eventsMap[e], e)
 
-    # Meta class for spotify event processing
+    # Meta class for spotify event processing.  The next wakeup is scheduled
+    # from the timeout requested by process_events(), or sooner if libspotify
+    # notifies the main thread, upto a maximum interval
     class __SpotifyEventProcessing__(threading.Thread):
 
-      def __init__(self, session, event, sleepInterval):
+      def __init__(self, session, event, maxInterval):
         threading.Thread.__init__(self)
         self.session = session
-        self.sleepInterval = sleepInterval
+        self.maxInterval = maxInterval
         self.event = event
         self.stop = False
+        self.wakeups = 0
+        self.notified = 0
+        self.lag = 0.0
+        self.maxLag = 0.0
 
       def run(self):
         while (not self.stop):
-          self.session.process_events()
-          self.event.wait(self.sleepInterval)
+          # Clear before processing so that a notification arriving while
+          # events are processed is not lost
           self.event.clear()
+          timeout = self.session.process_events()
+          if (timeout is None):
+            interval = self.maxInterval
+          else:
+            interval = min(timeout / 1000.0, self.maxInterval)
+          wakeTime = time.time() + interval
+          if (self.event.wait(interval)):
+            self.notified += 1
+          else:
+            # Track how late we woke for a requested timeout
+            lag = max(0.0, time.time() - wakeTime)
+            self.lag += lag
+            self.maxLag = max(self.maxLag, lag)
+          self.wakeups += 1
+
+      def GetStats(self):
+        timed = self.wakeups - self.notified
+        if (timed > 0):
+          meanLag = (self.lag * 1000) / timed
+        else:
+          meanLag = 0
+        return { 'wakeups': self.wakeups,
+                 'notified': self.notified,
+                 'meanLag': meanLag,
+                 'maxLag': self.maxLag * 1000 }
 
       def Exit(self):
         self.stop = True
+        self.event.set()
         self.join()
 
     # Initiate event processing thread
@@ -100,35 +279,68 @@ class SpotifyService():
       __SpotifyEventProcessing__(
                 self.session,
                 self.threadingEvent[spotify.SessionEvent.NOTIFY_MAIN_THREAD],
-                1)
+                self.MAX_EVENT_INTERVAL)
     self.thread.start()
 
   def Exit(self):
     self.thread.Exit()
+    self.__CloseAudioStream()
 
-  def __EventSearchComplete(self, param):
-    #print "'spotify.Search' search", param
-    self.eventQueue['spotify.Search'].append(param)
-    self.threadingEvent['spotify.Search'].set()
+  def __EventSearchComplete(self, handle):
+    #print "Search complete", handle
+    self.__ReleaseSearch(handle)
+
+  def __ReleaseSearch(self, handle):
+    """Helper function to stop counting a search as in progress"""
+    with self.searchLock:
+      self.pendingSearches.discard(handle)
 
   def __EventMusicDelivery(self, session, audioFormat, frames, numFrames, event):
     #print "Event: ", event, "produced", len(frames), "bytes"
 
-    # Set current audio format
-    self.audioFormat = self.__GetAudioFormat(audioFormat)
-
-    # Send data to audio buffer (may not be able to send all data)
-    nBytes = self.audioBuffer.Write(frames)
+    # Set current audio format, which is fixed when converting
+    inFormat = self.__GetAudioFormat(audioFormat)
+    if (self.converter):
+      self.audioFormat = self.converter.GetOutputFormat()
+    else:
+      self.audioFormat = inFormat
 
     # Post event to thread
     self.threadingEvent[event].set()
 
-    # Compute the number of frames sent
-    if (numFrames > 0):
+    # Measure the gap between tracks played back to back; the gap is the
+    # time the next track took to arrive less whatever audio was still
+    # buffered from the previous track when it ended
+    if (self.endOfTrack and numFrames > 0):
+      (endTime, bufferedMs) = self.endOfTrack
+      self.endOfTrack = None
+      elapsedMs = int((time.time() - endTime) * 1000)
+      self.interTrackGap = max(0, elapsedMs - bufferedMs)
+      Debug("Inter-track gap:", self.interTrackGap, "ms");
+
+    with self.deliveryLock:
+
+      # Frames from before a seek or track switch are consumed and dropped
+      if (self.discarding):
+        return numFrames
+
+      # Back off while the buffer is nearly full, libspotify will deliver
+      # the same frames again later
+      if (numFrames <= 0 or self.audioBuffer.IsAboveHighWatermark()):
+        return 0
+
+      # Only send whole frames which fit into the audio buffer so that
+      # nothing is dropped; any frames not consumed are redelivered by
+      # libspotify
       frameSize = len(frames) / numFrames
-      frameSent = nBytes / frameSize
-    else:
-      frameSent = 0
+      available = self.audioBuffer.GetBufAvailable() / self.audioFormat['frame_size']
+      if (self.converter):
+        available = self.converter.GetInputFrames(available, inFormat)
+      frameSent = min(numFrames, available)
+      data = memoryview(frames)[0:frameSent * frameSize]
+      if (self.converter):
+        data = self.converter.Convert(data, inFormat)
+      self.audioBuffer.Write(data)
 
     return frameSent
 
@@ -152,6 +364,11 @@ class SpotifyService():
   def __EventListenerEndOfTrack(self, session, event):
     #print "Event: ", event
     self.threadingEvent[event].set()
+    bufferedMs = self.__BytesToMs(self.audioBuffer.GetBufOccupancy())
+    self.endOfTrack = (time.time(), bufferedMs)
+    # Any track played straight on starts after the audio written so far
+    with self.deliveryLock:
+      self.trackBoundaries.append(self.audioBuffer.GetBufTotal())
     if (self.notifyCallback):
       self.notifyCallback()
 
@@ -194,29 +411,79 @@ class SpotifyService():
     if (wait):
       return self.WaitForLogout(timeout)
 
+  def __StartSearch(self, start):
+    """Helper function to start a search with its own completion handle,
+       start is called with the handle's completion callback"""
+    handle = SearchHandle(self.__EventSearchComplete)
+    with self.searchLock:
+      # Searches which libspotify never completed stop counting once stalled
+      now = time.time()
+      self.pendingSearches = set(h for h in self.pendingSearches
+                                 if now - h.started < self.SEARCH_STALL_TIMEOUT)
+      if (len(self.pendingSearches) >= self.MAX_PENDING_SEARCHES):
+        raise SpotifyServiceExceptionTooManySearches
+      self.pendingSearches.add(handle)
+    try:
+      start(handle.Complete)
+    except:
+      self.__ReleaseSearch(handle)
+      raise
+    return handle
+
   def SearchMore(self, search, wait=True, timeout=5):
-    s = search.more()
-    if (wait and not self.WaitForSearch(timeout)):
-      return None 
-    return s
+    """Search for more results following on from a completed search.
+       Returns the search when wait is set (None on timeout), otherwise a
+       SearchHandle -- use WaitForSearch() to wait"""
+    handle = self.__StartSearch(lambda callback: search.more(callback))
+    if (wait):
+      return self.WaitForSearch(handle, timeout)
+    return handle
 
   def SearchNew(self, query, trackOffset=0, albumOffset=0, artistOffset=0,
                 playlistOffset=0, suggest=False, maxCount=20, wait=True,
                 timeout=5):
-    """New search with a query -- use WaitForSearch() to wait"""
+    """New search with a query.  Returns the search when wait is set (None
+       on timeout), otherwise a SearchHandle -- use WaitForSearch() to wait.
+
+       Searches are cached, and a search identical to one still in progress
+       shares its handle rather than starting another search"""
     if (suggest):
       searchType = spotify.SearchType.SUGGEST
     else:
       searchType = spotify.SearchType.STANDARD
-    s = self.session.search(query,  self.eventsMap['spotify.Search'],
-                            track_offset=trackOffset, album_offset=albumOffset,
-                            artist_offset=artistOffset,
-                            playlist_offset=playlistOffset,
-                            track_count=maxCount, album_count=maxCount,
-                            playlist_count=maxCount, search_type=searchType)
-    if (wait and not self.WaitForSearch(timeout)):
-      return None
-    return s
+    def Start(callback):
+      self.session.search(query, callback,
+                          track_offset=trackOffset, album_offset=albumOffset,
+                          artist_offset=artistOffset,
+                          playlist_offset=playlistOffset,
+                          track_count=maxCount, album_count=maxCount,
+                          playlist_count=maxCount, search_type=searchType)
+    key = (' '.join(query.lower().split()), trackOffset, albumOffset,
+           artistOffset, playlistOffset, maxCount, searchType)
+    handle = self.searchCache.GetOrCreate(key,
+                                          lambda: self.__StartSearch(Start))
+    if (wait):
+      return self.WaitForSearch(handle, timeout)
+    return handle
+
+  def __IsSearchUsable(self, handle):
+    """A cached search is usable while in progress, unless it has stalled,
+       or once it has completed without error"""
+    if (not handle.IsComplete()):
+      return (time.time() - handle.started) < self.SEARCH_STALL_TIMEOUT
+    return handle.search.error == spotify.ErrorType.OK
+
+  def GetEventLoopStats(self):
+    """Event loop wakeup counts and lag (in ms) behind requested wakeups"""
+    return self.thread.GetStats()
+
+  def GetSearchCacheStats(self):
+    """Search cache hit, miss and eviction counts and size"""
+    return self.searchCache.GetStats()
+
+  def GetPendingSearches(self):
+    """Number of searches started which have not yet completed"""
+    return len(self.pendingSearches)
 
   def WaitForLogin(self, timeout):
     """Wait for timeout for a login connection"""
@@ -226,13 +493,14 @@ class SpotifyService():
     """Wait for timeout for a logout disconnection"""
     return self.__WaitForEvent(spotify.SessionEvent.LOGGED_OUT, timeout)
 
-  def WaitForSearch(self, timeout):
-    """Wait for timeout for a search completion"""
-    return self.__WaitForEvent('spotify.Search', timeout)
-
-  def __WaitForAudioDelivery(self, timeout):
-    """Wait for audio delivery event"""
-    return self.__WaitForEvent(spotify.SessionEvent.MUSIC_DELIVERY, timeout)
+  def WaitForSearch(self, handle, timeout):
+    """Wait for timeout for a search's completion, returns the search or
+       None on timeout.  A search which times out no longer counts towards
+       MAX_PENDING_SEARCHES"""
+    search = handle.Wait(timeout)
+    if (search is None):
+      self.__ReleaseSearch(handle)
+    return search
 
   def WaitForStop(self, timeout):
     """Wait for playback stop event"""
@@ -253,53 +521,232 @@ class SpotifyService():
   def NotifyCallback(self, callback):
     self.notifyCallback = callback
 
-  def PlayTrack(self, track, timeout=2):
-    """Play a track and initiate audio stream"""
-
-    # Stop any tracks already going so we're clean
-    self.Stop()
+  def AddEventListener(self, event, callback):
+    """Call callback(*args) with the event's arguments (if any) each time a
+       libspotify session event happens.  The callback runs on the
+       libspotify thread so it must not block"""
+    self.session.on(event, lambda session, *args: callback(*args))
 
-    # Retry upto 3 times
-    for i in range(3):
-      # Prepare next track to play
+  def PlayTrack(self, track, timeout=2):
+    """Switch to playing a track and start the audio stream.  Returns False
+       if the track's audio stalls, in which case the track is unloaded so
+       that the caller can move straight on to another track.
+
+       A switch goes through the states 'loading' (the new track replaces
+       the old one in the player), 'buffering' (the prebuffer fills) and
+       'playing', or 'stalled' on failure.  Nothing waits on libspotify
+       events which may never arrive, progress is judged from the audio
+       buffer occupancy alone"""
+    start = time.time()
+    self.endOfTrack = None
+    self.switchCount += 1
+
+    # Loading a track replaces any track already going, so only the audio
+    # stream needs stopping and any stale audio discarding.  As for a seek,
+    # deliveries are dropped until the new track is loaded so that none of
+    # the old track's audio lands after the flush
+    self.switchState = 'loading'
+    self.__StopAudioStream()
+    with self.deliveryLock:
+      self.discarding = True
       self.audioBuffer.Flush()
-      self.audioBuffer.Write(chr(0)*4*2*44100)
+      self.trackStart = 0
+      self.trackBoundaries.clear()
+      if (self.converter):
+        self.converter.Reset()
+    try:
       self.session.player.load(track)
-      self.session.player.play()
-
-      # Wait for audio delivery to start before starting audio stream
-      Debug("Waiting for audio delivery - attempt:", i+1);
-      if (self.__WaitForAudioDelivery(timeout)):
-        Debug("Audio delivery started");
-        self.__StartAudioStream()
+    finally:
+      with self.deliveryLock:
+        self.discarding = False
+    self.session.player.play()
+
+    self.switchState = 'buffering'
+    if (not self.__WaitForPrebuffer(timeout)):
+      Debug("Audio delivery stalled");
+      self.switchState = 'stalled'
+      self.switchFailures += 1
+      self.session.player.unload()
+      return False
+
+    self.audioBuffer.AddSilence(self.__MsToBytes(self.leadingSilenceMs))
+    self.__StartAudioStream()
+    self.switchState = 'playing'
+    self.timeToFirstAudio = int((time.time() - start) * 1000)
+    self.switchLatencies.append(self.timeToFirstAudio)
+    Debug("Audio delivery started, time to first audio:",
+          self.timeToFirstAudio, "ms");
+    return True
+
+  def __WaitForPrebuffer(self, timeout):
+    """Helper function to wait for the prebuffer to fill during a track
+       switch.  Returns False if no audio arrives within timeout.  Once
+       audio is arriving the wait ends when the prebuffer is full, when no
+       more audio has arrived for STALL_TIMEOUT or after timeout, and the
+       stream is started with whatever audio there is"""
+    deadline = time.time() + timeout
+
+    # The first audio delivery sets the audio format, which is needed to
+    # size the prebuffer
+    if (not self.audioBuffer.WaitForOccupancy(1, timeout)):
+      return False
+    prebuffer = self.__MsToBytes(self.prebufferMs)
+    level = self.audioBuffer.GetBufTotal()
+    progressTime = time.time()
+    while (not self.audioBuffer.WaitForOccupancy(prebuffer,
+                                                 self.STALL_POLL_INTERVAL)):
+      now = time.time()
+      total = self.audioBuffer.GetBufTotal()
+      if (total > level):
+        level = total
+        progressTime = now
+      elif (now - progressTime >= self.STALL_TIMEOUT):
+        Debug("Audio prebuffer stalled");
         break
-      else:
-        # No audio delivery event before timeout
-        Debug("Audio delivery timed out");
-        self.Stop()
+      if (now >= deadline):
+        Debug("Audio prebuffer timed out");
+        break
+    return True
+
+  def GetSwitchState(self):
+    """State of the last track switch, one of 'idle', 'loading',
+       'buffering', 'playing' or 'stalled'"""
+    return self.switchState
+
+  def GetSwitchStats(self):
+    """Track switch counts and percentiles of the time in milliseconds
+       taken by recent successful switches to start audio"""
+    latencies = sorted(self.switchLatencies)
+    def Percentile(percent):
+      if (not latencies):
+        return None
+      return latencies[min(len(latencies) - 1,
+                           (len(latencies) * percent) // 100)]
+    return { 'count': self.switchCount,
+             'failures': self.switchFailures,
+             'p50': Percentile(50),
+             'p90': Percentile(90),
+             'p99': Percentile(99),
+             'max': Percentile(100) }
+
+  def PrefetchTrack(self, track):
+    """Hint to libspotify that a track will be played next so that it can
+       be fetched ahead of time"""
+    self.session.player.prefetch(track)
+
+  def ContinueWithTrack(self, track):
+    """Play a track straight after the one which has just ended.  The audio
+       stream is left running and the new track's audio follows on in the
+       same buffer, so there is no gap between the two tracks"""
+    self.session.player.load(track)
+    self.session.player.play()
+
+  def GetInterTrackGap(self):
+    """Gap in milliseconds between the last two tracks played back to back"""
+    return self.interTrackGap
+
+  def GetTimeToFirstAudio(self):
+    """Time in milliseconds taken by the last PlayTrack() to start audio"""
+    return self.timeToFirstAudio
 
   def __StartAudioStream(self):
-    """Helper function to create audio stream with correct properties"""
-    self.stream = AudioStream(self.audioBuffer,
-                              self.audioFormat['width'],
-                              self.audioFormat['channels'],
-                              self.audioFormat['rate'])
+    """Helper function to start audio stream with correct properties, the
+       audio stream is created once and then reused for each track"""
+    if (self.stream):
+      self.stream.Configure(self.audioBuffer,
+                            self.audioFormat['width'],
+                            self.audioFormat['channels'],
+                            self.audioFormat['rate'])
+    else:
+      self.stream = self.__CreateAudioSink()
     self.stream.Start()
 
+  def __CreateAudioSink(self):
+    """Helper function to create the selected audio sink, only the sink in
+       use is imported so that PyAudio isn't needed for the other sinks"""
+    if (self.sink == 'null'):
+      from AudioSink import NullAudioSink as Sink
+    elif (self.sink == 'file'):
+      from AudioSink import FileAudioSink as Sink
+    else:
+      from AudioStream import AudioStream as Sink
+    return Sink(self.audioBuffer,
+                self.audioFormat['width'],
+                self.audioFormat['channels'],
+                self.audioFormat['rate'],
+                processor=self.volume,
+                **self.sinkArgs)
+
   def __StopAudioStream(self):
-    """Helper function to safely stop audio stream"""
+    """Helper function to safely stop audio stream, keeping it open"""
+    if (self.__IsStreamActive()):
+      self.stream.Stop()
+
+  def __CloseAudioStream(self):
+    """Helper function to release the audio stream and device"""
     if (self.stream):
       self.stream.Exit()
       self.stream = None
 
-  def Stop(self, wait=True, timeout=1):
-    """Stop current tracking playing including audio stream"""
+  def __IsStreamActive(self):
+    """Helper function to tell us whether a track's stream is running"""
+    return (self.stream is not None and self.stream.IsActive())
+
+  def Stop(self):
+    """Stop current tracking playing including audio stream.  Unloading
+       the track takes effect straight away so there's no need to wait for
+       libspotify to stop"""
     # Cleanly stop the audio stream if it is running
     self.__StopAudioStream()
     self.session.player.unload()
-    if (wait):
-      self.WaitForStop(timeout)
-      self.__WaitForAudioDelivery(timeout)
+    self.audioBuffer.Flush()
+    self.switchState = 'idle'
+
+  def Seek(self, ms):
+    """Seek to ms into the current track.  The track isn't reloaded and the
+       audio stream keeps running, only the audio buffered from before the
+       seek is discarded.  Returns False if there is no track playing"""
+    if (not self.__IsStreamActive()):
+      return False
+    # Deliveries are dropped from the discard until libspotify has seeked,
+    # so no audio from before the seek can land after the discard.  The
+    # seek itself is made without the delivery lock held since libspotify
+    # may be waiting on a delivery to finish
+    with self.deliveryLock:
+      self.discarding = True
+      self.audioBuffer.Discard()
+      if (self.converter):
+        self.converter.Reset()
+    try:
+      self.session.player.seek(ms)
+    finally:
+      with self.deliveryLock:
+        self.discarding = False
+        self.endOfTrack = None
+        self.trackBoundaries.clear()
+        self.trackStart = (self.audioBuffer.GetBufConsumed() -
+                           self.__MsToBytes(ms))
+    return True
+
+  def GetTrackPosition(self):
+    """Position in the current track as (frames, rate).  This counts the
+       frames of the track consumed by the audio sink less those still in
+       the sink's output latency, so it is accurate to the sample rather
+       than to a timer.  It may be called from any thread"""
+    if (not self.__IsStreamActive()):
+      return (0, 0)
+    # Track boundaries are changed by seeks and track switches under the
+    # delivery lock too
+    with self.deliveryLock:
+      consumed = self.audioBuffer.GetBufConsumed()
+      # Move on to any tracks played straight on once their audio is reached
+      while (self.trackBoundaries and consumed >= self.trackBoundaries[0]):
+        self.trackStart = self.trackBoundaries.popleft()
+      trackStart = self.trackStart
+    rate = self.audioFormat['rate']
+    frames = (consumed - trackStart) // self.audioFormat['frame_size']
+    frames -= int(self.stream.GetLatency() * rate)
+    return (max(0, frames), rate)
 
   def Pause(self):
     if (self.stream):
@@ -309,13 +756,40 @@ class SpotifyService():
     if (self.stream):
       self.stream.Resume()
 
+  def HasSoftwareVolume(self):
+    """Tells us whether volume is applied in-process"""
+    return self.volume is not None
+
   def Mute(self):
-    if (self.stream):
-      self.stream.Mute()
+    if (self.volume):
+      self.volume.Mute()
 
   def Unmute(self):
-    if (self.stream):
-      self.stream.Unmute()
+    if (self.volume):
+      self.volume.Unmute()
+
+  def SetVolume(self, volume):
+    """Set software volume level as a percentage 0 to 100"""
+    if (self.volume):
+      self.volume.SetVolume(volume)
+
+  def GetVolume(self):
+    """Software volume level as a percentage or None if not in use"""
+    if (self.volume):
+      return self.volume.GetVolume()
+    return None
+
+  def __MsToBytes(self, ms):
+      """Helper function to convert ms to nBytes of whole frames"""
+      frameSize = self.audioFormat['width'] * self.audioFormat['channels']
+      return ((ms * self.audioFormat['rate']) / 1000) * frameSize
+
+  def __BytesToMs(self, nBytes):
+      """Helper function to convert nBytes to ms"""
+      if (self.audioFormat):
+        return (self.__BytesToSamples(nBytes) * 1000) / self.audioFormat['rate']
+      else:
+        return 0
 
   def __BytesToSamples(self, nBytes):
       """Helper function to convert nBytes to nSamples"""
@@ -329,7 +803,7 @@ class SpotifyService():
     """Compute statistics about the performance of the audio stream"""
     # The audio buffer only tracks bytes and we can only convert to samples
     # once we have an audio stream established with known properties
-    if (self.stream):
+    if (self.__IsStreamActive()):
       totalSamples = self.__BytesToSamples(self.audioBuffer.GetBufTotal())
       numSamples = self.__BytesToSamples(self.audioBuffer.GetBufOccupancy())
       numDropped = self.__BytesToSamples(self.audioBuffer.GetBufDropped())
@@ -348,8 +822,14 @@ class SpotifyService():
 
     return (numSamples, numDropped, percent, totalSamples, rate)
 
-  def GetPlayState(self):
+  def GetCallbackStats(self):
+    """Audio stream callback timing statistics"""
     if (self.stream):
+      return self.stream.GetCallbackStats()
+    return None
+
+  def GetPlayState(self):
+    if (self.__IsStreamActive()):
       if (self.stream.IsPlaying()):
         return 'playing'
       else:
@@ -364,6 +844,66 @@ class SpotifyService():
              'channels': audioFormat.channels,
              'frame_size': audioFormat.frame_size() }
 
+  def __MakeTrackRecord(self, track):
+    """Helper function to make a compact, JSON ready track record"""
+    record = self.GetTrackInfo(track)
+    record['artists'] = [a.name for a in record['artists']]
+    record['imageUri'] = record['album'].cover().link.uri
+    record['album'] = record['album'].name
+    record['link'] = record['link'].uri
+    record.pop('playable', None)
+    return record
+
+  @staticmethod
+  def __MakePlaceholderRecord(uri):
+    """Helper function to make a record for a track which didn't load"""
+    return { 'is_loaded': False, 'link': uri, 'name': '', 'album': '',
+             'artists': [], 'imageUri': None, 'duration': 0 }
+
+  def ExpandTracks(self, uris, timeout=5):
+    """Returns a list of compact track records (see GetTrackInfo()) for a
+       list of track URIs, or None for a URI of None.  Tracks which aren't
+       cached are loaded together as a batch rather than one at a time, and
+       any which fail to load within timeout get a placeholder record with
+       'is_loaded' set to False"""
+    records = {}
+    pending = []
+    for uri in set(uris):
+      if (uri is None):
+        continue
+      record = self.trackCache.Get(uri)
+      if (record):
+        records[uri] = record
+      else:
+        pending.append((uri, spotify.Track(uri)))
+
+    # Creating the tracks starts them all loading, so wait on them together
+    event = self.threadingEvent[spotify.SessionEvent.METADATA_UPDATED]
+    deadline = time.time() + timeout
+    while (pending):
+      waiting = []
+      for (uri, track) in pending:
+        if (track.is_loaded):
+          records[uri] = self.__MakeTrackRecord(track)
+          self.trackCache.Put(uri, records[uri])
+        else:
+          waiting.append((uri, track))
+      pending = waiting
+      remaining = deadline - time.time()
+      if (not pending or remaining <= 0):
+        break
+      if (event.wait(min(remaining, 0.1))):
+        event.clear()
+
+    for (uri, track) in pending:
+      Debug("Track metadata timed out:", uri);
+      records[uri] = SpotifyService.__MakePlaceholderRecord(uri)
+    return [records.get(uri) for uri in uris]
+
+  def GetTrackCacheStats(self):
+    """Track cache hit, miss and eviction counts and size"""
+    return self.trackCache.GetStats()
+
   def GetSearchInfo(self, search):
     """Convert search object to a dict"""
     return { 'is_loaded': search.is_loaded,
@@ -24,6 +24,8 @@
   lastTrackState = null,
   playlistHash = null,
   lastPlaylistHash = null,
+  playlistVersion = null,
+  eventSource = null,
   imageCache = {},
   callbacks = {};
 
@@ -68,8 +70,8 @@
   var trackPositionTimer = function() {
     var state = getTrackPlayState();
     if (trackPos && state == 'playing') {
-      // Advance track position by 1s
-      trackPos['total'] += trackPos['rate'];
+      // Advance track position by 1s between updates from the server
+      trackPos['frames'] += trackPos['rate'];
       if (notifyTrackPos(trackPos)) {
         // Track end position detected
         updateTrack();
@@ -81,8 +83,8 @@
   };
 
   var resetTrackPosition = function(data) {
-    trackPos = getItem(data, 'stats');
-    trackPos['total'] -= trackPos['rate']/2;
+    // Position is counted by the server from the audio actually played
+    trackPos = getItem(data, 'position');
   };
 
   var notifyPlaylist = function() {
@@ -98,31 +100,41 @@
     }
   };
 
+  var getImageUrl = function(imageUri, size) {
+    // Images are served and cached by the server, so the browser can
+    // cache them too
+    var imageUrl = url + '/image/' + encodeURIComponent(imageUri);
+    if (size) {
+      imageUrl += '?size=' + size;
+    }
+    return imageUrl;
+  };
+
   var getTrackImage = function(imageUri, param, callback) {
     if (imageUri in imageCache) {
-      // Image is cached, so notify with data from cache
+      // Image is known, so notify with its thumbnail URL
       callback(false, // Cached => false: not a new image
                param,
                imageCache[imageUri]);
     } else {
-      musicCommand('image ' + imageUri, function(data) {
-        imageCache[imageUri] = getItem(data,'image');
-        callback(true, // Not cached => true: a new image
-                 param,
-                 imageCache[imageUri]);
-      });
+      imageCache[imageUri] = getImageUrl(imageUri, player.THUMBNAIL_SIZE);
+      callback(true, // Not cached => true: a new image
+               param,
+               imageCache[imageUri]);
     }
   };
 
   var loadPlaylistImages = function() {
+    var anyNew = false;
     for (var i = 0; i < playlist.length; i++) {
       uri = playlist[i]['imageUri']
       getTrackImage(uri, i, function(isNew, idx, image) {
-        if (isNew && player.EVENT_PLAYLIST in callbacks) {
-          notifyPlaylist();
-        }
+        anyNew = anyNew || isNew;
       });
     }
+    if (anyNew && player.EVENT_PLAYLIST in callbacks) {
+      notifyPlaylist();
+    }
   };
 
   var notifyCurrentTrackImage = function(state, imageUri) {
@@ -130,10 +142,7 @@
       var cb = callbacks[player.EVENT_TRACK_IMAGE];
       cb(null); // Clear current image while new one loads
       if (imageUri && (state == 'playing' || state == 'paused')) {
-        getTrackImage(imageUri, null, function(isNew, param, img) {
-          var cb = callbacks[player.EVENT_TRACK_IMAGE];
-          cb(img);
-        });
+        cb(getImageUrl(imageUri, null));
       }
     }
   };
@@ -177,12 +186,36 @@
     });
   };
 
+  var applyPlaylistChanges = function(changes) {
+    for (var i = 0; i < changes.length; i++) {
+      var op = changes[i]['op'], tracks = changes[i]['tracks'];
+      if (op == 'insert') {
+        playlist = tracks.concat(playlist);
+      } else if (op == 'append') {
+        playlist = playlist.concat(tracks);
+      } else if (op == 'clear') {
+        playlist = [];
+      }
+    }
+  };
+
   var updatePlaylist = function() {
     musicCommand('info playlisthash', function(data) {
       playlistHash = getItem(data, 'playlisthash');
       if (playlistHash != lastPlaylistHash) {
-        musicCommand('info playlist', function(data) {
-          playlist = getItem(data, 'playlist');
+        // Only the changes since our version are needed once we have one
+        var cmd = 'info playlist';
+        if (playlistVersion != null) {
+          cmd += ' since ' + playlistVersion;
+        }
+        musicCommand(cmd, function(data) {
+          var changes = getItem(data, 'changes');
+          if (changes) {
+            applyPlaylistChanges(changes);
+          } else {
+            playlist = getItem(data, 'playlist');
+          }
+          playlistVersion = getItem(data, 'playlistVersion');
           notifyPlaylist();
           loadPlaylistImages();
         });
@@ -247,10 +280,11 @@
   };
 
   var calcTrackPosition = function(s) {
-    totalSamples = s['total'];
-    occupancy = s['occupancy'];
-    sampleRate = s['rate'];
-    currMs = Math.round((1000 * (totalSamples-occupancy)) / sampleRate);
+    if (s['rate'] > 0) {
+      currMs = Math.round((1000 * s['frames']) / s['rate']);
+    } else {
+      currMs = 0;
+    }
     if (getItem(track, 'track')) {
       trackLenMs = getItem(track, 'track')['duration'];
     } else {
@@ -283,11 +317,49 @@
 
   var startPeriodicEvents = function() {
     updateTrack();
-    if (powerOn) {
+    if (powerOn && !eventSource) {
       setTimeout(arguments.callee, 10000);
     }
   };
 
+  var startEventStream = function() {
+    // The server pushes changes as they happen, so nothing needs polling
+    // while the stream is open.  Browsers without EventSource keep polling
+    if (!window.EventSource) {
+      return;
+    }
+    eventSource = new EventSource(url + '/events');
+    var handlers = {
+      'track': function(data) { updateTrack(); },
+      'state': function(data) { updateTrack(); },
+      'seek': function(data) { updateTrack(); },
+      'playlist': function(data) { updatePlaylist(); },
+      'shuffle': function(data) {
+        lastShuffle = shuffle;
+        shuffle = data;
+        notifyShuffle();
+      },
+      'volume': function(data) {
+        lastVolume = volume;
+        volume = data;
+        notifyVolume();
+      }
+    };
+    $.each(handlers, function(name, handler) {
+      eventSource.addEventListener(name, function(e) {
+        debugLog('Event ' + name + ': ' + e.data);
+        handler(JSON.parse(e.data));
+      });
+    });
+  };
+
+  var stopEventStream = function() {
+    if (eventSource) {
+      eventSource.close();
+      eventSource = null;
+    }
+  };
+
   // Public API exported through 'player' dictionary
   player = {
 
@@ -302,6 +374,9 @@
     EVENT_PLAYLIST_IMAGE: 7,
     EVENT_SINKS_UPDATED: 8,
 
+    // Size in pixels of playlist thumbnail images
+    THUMBNAIL_SIZE: 64,
+
     // API Functions
     setUrl: function(u) {
       url = u;
@@ -321,15 +396,18 @@
         lastTrackState = null;
         playlistHash = null;
         lastPlaylistHash = null;
+        playlistVersion = null;
         track = [];
         playlist = [];
         updateShuffle();
         updateSinks();
         updateVolume();
         updatePlaylist();
+        startEventStream();
         startPeriodicEvents();
         trackPositionTimer();
       } else {
+        stopEventStream();
         musicCommand('stop', function(data) {
           updateTrack();
         });
@@ -393,6 +471,14 @@
         musicCommand('volume ' + vol, function(data){});
       }
     },
+    seek: function(ms) {
+      if (powerOn) {
+        trackPos = null;
+        musicCommand('seek ' + Math.floor(ms / 1000), function(data) {
+          updateTrack();
+        });
+      }
+    },
     skip: function() {
       if (powerOn) {
         trackPos = null;
@@ -0,0 +1,58 @@
+"""
+Tests for PlayQueue, run with the simulated Spotify backend:
+
+  python -m unittest test_PlayQueue
+"""
+
+import os
+import unittest
+
+os.environ.setdefault('SPOTIFY_SIMULATOR', '1')
+from PlayQueue import PlayQueue
+
+class StubSession():
+  """Just enough of SpotifyService for a PlayQueue"""
+
+  def NotifyCallback(self, callback):
+    pass
+
+  def Stop(self):
+    pass
+
+  def PrefetchTrack(self, track):
+    pass
+
+  def PlayTrack(self, track):
+    return True
+
+  def ContinueWithTrack(self, track):
+    pass
+
+class TestShuffledSkip(unittest.TestCase):
+
+  def setUp(self):
+    self.pq = PlayQueue(StubSession())
+    self.pq.Shuffle('on')
+
+  def testSkipEmpty(self):
+    self.pq.SkipForward()
+    self.pq.SkipBack()
+    self.assertEqual(self.pq.GetCurrentTrack(), None)
+
+  def testSkipAfterClear(self):
+    self.pq.Append(['a', 'b', 'c'])
+    self.pq.SkipForward()
+    self.pq.Clear()
+    self.pq.SkipForward(2)
+    self.assertEqual(self.pq.QueueSize(), 0)
+    self.assertEqual(self.pq.GetCurrentTrack(), None)
+
+  def testSkipAfterRefill(self):
+    self.pq.Append(['a', 'b', 'c'])
+    self.pq.Clear()
+    self.pq.Append(['d', 'e'])
+    self.pq.SkipForward()
+    self.assertIn(self.pq.GetCurrentTrack(), ['d', 'e'])
+
+if __name__ == '__main__':
+  unittest.main()